@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Configuration
+CACHE_FOLDER = 'analysis_cache'
+MAX_MEMORY_ENTRIES = 256
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class AnalysisCache:
+    """Cache of Gemini analyses keyed by the image content
+
+    The key is a SHA-256 of the image bytes plus a version string naming
+    the model and prompt, so re-sending the same capture reuses the earlier
+    analysis while a model or prompt change starts from a clean slate.
+    Entries live in an in-memory LRU backed by one JSON file per key on disk.
+    """
+
+    def __init__(self, version, folder=CACHE_FOLDER, max_memory_entries=MAX_MEMORY_ENTRIES):
+        self.version = version
+        self.folder = folder
+        self.max_memory_entries = max_memory_entries
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> analysis, least recently used first
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'invalidations': 0
+        }
+
+    def key_for(self, image_data):
+        """Cache key for a set of image bytes"""
+        digest = hashlib.sha256()
+        digest.update(self.version.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(image_data)
+        return digest.hexdigest()
+
+    def key_for_file(self, file_path):
+        """Cache key for an image file, hashed in chunks without loading it whole"""
+        digest = hashlib.sha256()
+        digest.update(self.version.encode('utf-8'))
+        digest.update(b'\0')
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Get a cached analysis, or None on a miss"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return self._memory[key]
+
+        try:
+            with open(self._path(key), 'r') as f:
+                analysis = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._counters['misses'] += 1
+            return None
+
+        with self._lock:
+            self._counters['disk_hits'] += 1
+            self._remember(key, analysis)
+        return analysis
+
+    def put(self, key, analysis):
+        """Store an analysis in memory and on disk"""
+        with self._lock:
+            self._counters['stores'] += 1
+            self._remember(key, analysis)
+
+        # Write to a temporary file first so readers never see a partial entry
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(analysis, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing analysis cache entry: {e}")
+
+    def invalidate(self, key):
+        """Drop one cached analysis"""
+        with self._lock:
+            self._memory.pop(key, None)
+            self._counters['invalidations'] += 1
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Drop every cached analysis"""
+        with self._lock:
+            self._memory.clear()
+            self._counters['invalidations'] += 1
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """Hit/miss counters and the current in-memory size"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            return stats
+
+    def _remember(self, key, analysis):
+        """Add an entry to the LRU. Must be called with the lock held."""
+        self._memory[key] = analysis
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
@@ -47,6 +47,15 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentRequestId = null;
     let currentAnalysisData = null;
     
+    // Server-sent progress events (polling is only used as a fallback)
+    const IMAGE_EVENT_TIMEOUT = 15000;
+    const JOB_POLL_INTERVAL = 1000;
+    const JOB_EVENT_TIMEOUT = 10000;
+    let progressEvents = null;
+    let waitingForImage = false;
+    let waitingForAnalysis = false;
+    let imageFallbackTimer = null;
+    
     // Check if we're on the dashboard page
     const isDashboard = document.querySelector('.dashboard-container') !== null;
     console.log("Is dashboard page:", isDashboard);
@@ -111,6 +120,38 @@ document.addEventListener('DOMContentLoaded', function() {
         setInterval(checkPiStatus, 30000);
     }
     
+    // Subscribe to capture and analysis progress events
+    function subscribeToProgressEvents() {
+        if (!window.EventSource || progressEvents) return;
+        
+        progressEvents = new EventSource('/events');
+        
+        progressEvents.addEventListener('image_uploaded', event => {
+            const data = JSON.parse(event.data);
+            if (waitingForImage && data.request_id === currentRequestId) {
+                showCapturedImage(data.filename);
+            }
+        });
+        
+        progressEvents.addEventListener('analysis_started', event => {
+            const data = JSON.parse(event.data);
+            console.log("Analysis started for", data.filename);
+        });
+        
+        progressEvents.addEventListener('analysis_done', event => {
+            if (!waitingForAnalysis) return;
+            waitingForAnalysis = false;
+            fetchAnalysisResults();
+        });
+        
+        progressEvents.onerror = error => {
+            // EventSource reconnects on its own
+            console.warn("Progress event stream interrupted:", error);
+        };
+    }
+    
+    if (cameraView) subscribeToProgressEvents();
+    
     // Event Listeners for camera functionality - only set if elements exist
     if (captureBtn) captureBtn.addEventListener('click', captureImage);
     if (retakeBtn) retakeBtn.addEventListener('click', retakePhoto);
@@ -158,9 +199,15 @@ document.addEventListener('DOMContentLoaded', function() {
             if (data.status === 'success') {
                 currentRequestId = data.request_id;
                 updateLoadingStep(1, "Waiting for camera...");
+                waitingForImage = true;
                 
-                // Wait for the Pi to process (give it time to poll and capture)
-                setTimeout(checkForLatestImage, 3000);
+                if (progressEvents) {
+                    // The image_uploaded event shows the capture; only poll if it never arrives
+                    imageFallbackTimer = setTimeout(checkForLatestImage, IMAGE_EVENT_TIMEOUT);
+                } else {
+                    // Wait for the Pi to process (give it time to poll and capture)
+                    setTimeout(checkForLatestImage, 3000);
+                }
             } else {
                 throw new Error(data.message || 'Failed to queue capture request');
             }
@@ -175,20 +222,32 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function showCapturedImage(filename) {
+        waitingForImage = false;
+        clearTimeout(imageFallbackTimer);
+        
+        // Image is available
+        currentImageFilename = filename;
+        if (reviewImage) reviewImage.src = `/uploads/${filename}?t=${new Date().getTime()}`;
+        
+        // Show review screen
+        if (loadingView) loadingView.classList.add('hidden');
+        if (reviewView) reviewView.classList.remove('hidden');
+    }
+    
     function checkForLatestImage() {
+        // The image may already have arrived through the event stream
+        if (!waitingForImage) return;
+        
         updateLoadingStep(2, "Checking for image...");
         
         fetch('/get-latest-image')
         .then(response => response.json())
         .then(data => {
+            if (!waitingForImage) return;
+            
             if (data.status === 'success') {
-                // Image is available
-                currentImageFilename = data.filename;
-                if (reviewImage) reviewImage.src = `/uploads/${data.filename}?t=${new Date().getTime()}`;
-                
-                // Show review screen
-                if (loadingView) loadingView.classList.add('hidden');
-                if (reviewView) reviewView.classList.remove('hidden');
+                showCapturedImage(data.filename);
             } else if (data.status === 'waiting') {
                 // Still waiting for image, check again
                 setTimeout(checkForLatestImage, 2000);
@@ -221,6 +280,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Reset current image
         currentImageFilename = null;
+        waitingForImage = false;
     }
     
     function analyzePhoto() {
@@ -233,22 +293,19 @@ document.addEventListener('DOMContentLoaded', function() {
         if (loadingView) loadingView.classList.remove('hidden');
     
         resetLoadingSteps();
-        updateLoadingStep(0, "Preparing image...");
-    
-        // Get the image from the server
-        fetch(`/uploads/${currentImageFilename}`)
-            .then(res => res.blob())
-            .then(blob => {
-                const formData = new FormData();
-                formData.append('image', blob, currentImageFilename);
+        updateLoadingStep(0, "Sending to Gemini...");
     
-                updateLoadingStep(1, "Sending to Gemini...");
-    
-                return fetch('/analyze-image', {
-                    method: 'POST',
-                    body: formData
-                });
+        // The image is already on the server, so only send its name
+        fetch('/analyze-image', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                filename: currentImageFilename,
+                request_id: currentRequestId
             })
+        })
             .then(response => {
                 if (!response.ok) {
                     throw new Error(`Server responded with status: ${response.status}`);
@@ -256,7 +313,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
+                if (!data || !data.job_id) {
+                    throw new Error((data && data.error) || "Failed to queue analysis");
+                }
+                return waitForJob(data.job_id);
+            })
+            .then(job => {
                 updateLoadingStep(2, "Processing Gemini results...");
+                const data = { response: job.result };
                 console.log("Received data from server:", data);
     
                 if (data && data.response) {
@@ -285,6 +349,55 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     
+    // Wait for a background job to finish. With the event stream open the job
+    // is only checked when a job_update event says it is done; otherwise it is polled.
+    function waitForJob(jobId) {
+        return new Promise((resolve, reject) => {
+            let timer = null;
+            let onUpdate = null;
+            
+            const finish = (callback, value) => {
+                clearTimeout(timer);
+                if (onUpdate) progressEvents.removeEventListener('job_update', onUpdate);
+                callback(value);
+            };
+            
+            const checkJob = () => {
+                fetch(`/jobs/${jobId}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status !== 'success') {
+                        throw new Error(data.message || 'Job not found');
+                    }
+                    
+                    const job = data.job;
+                    if (job.state === 'done') {
+                        finish(resolve, job);
+                    } else if (job.state === 'failed') {
+                        finish(reject, new Error(job.error || 'Analysis failed'));
+                    } else {
+                        clearTimeout(timer);
+                        timer = setTimeout(checkJob, progressEvents ? JOB_EVENT_TIMEOUT : JOB_POLL_INTERVAL);
+                    }
+                })
+                .catch(error => finish(reject, error));
+            };
+            
+            if (progressEvents) {
+                onUpdate = event => {
+                    const data = JSON.parse(event.data);
+                    if (data.job_id === jobId && (data.state === 'done' || data.state === 'failed')) {
+                        checkJob();
+                    }
+                };
+                progressEvents.addEventListener('job_update', onUpdate);
+            }
+            
+            updateLoadingStep(1, "Waiting for Gemini...");
+            checkJob();
+        });
+    }
+    
     function fetchAnalysisResults() {
         updateLoadingStep(2, "Retrieving results...");
         
@@ -327,9 +440,13 @@ document.addEventListener('DOMContentLoaded', function() {
         .catch(error => {
             console.error('Error:', error);
             
-            // If the server is still processing, try again
+            // If the server is still processing, wait for it to finish
             if (error.message.includes('No analysis results found')) {
-                setTimeout(fetchAnalysisResults, 2000);
+                if (progressEvents) {
+                    waitingForAnalysis = true;
+                } else {
+                    setTimeout(fetchAnalysisResults, 2000);
+                }
                 return;
             }
             
@@ -588,6 +705,9 @@ function drawBoundingBoxes(predictions) {
         // Clear current capture
         currentImageFilename = null;
         currentRequestId = null;
+        waitingForImage = false;
+        waitingForAnalysis = false;
+        clearTimeout(imageFallbackTimer);
         
         // Reset views
         if (resultsView) resultsView.classList.add('hidden');
@@ -1,26 +1,36 @@
 import os
 import json
-import requests
-import threading
 import time
-import base64
 from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Response, stream_with_context
 from flask import redirect, url_for, flash, session
 from flask_cors import CORS
 from datetime import datetime, timedelta
-from functools import wraps
 import uuid
-import hashlib
-import socket
-import subprocess
-import json
-import requests
 from urllib.parse import urlparse
-import sqlite3
 
 # Import the auth module
 from auth import user_manager, login_required, api_login_required, init_session, clear_session
+from auth import verify_password, load_password, PasswordHasherBusy
 from models import scan_manager
+from database import db
+from heartbeat_writer import HeartbeatWriter
+from telemetry import TelemetryWriter
+from brushing_store import BrushingStore, COVERAGE_DAYS
+from presence import PresenceTracker
+from capture_queue import CaptureQueue, DEFAULT_DEVICE_ID
+from devices import DeviceRegistry, esp32_device_id
+from discovery import DeviceDiscovery, local_address
+from device_relay import DeviceRelay
+from events import EventBroker
+from jobs import JobManager, JobQueueFull
+from image_index import ImageIndex
+from analysis_cache import AnalysisCache
+from http_client import HttpClient
+from gemini_client import GeminiClient
+from image_preprocess import ImagePreprocessor
+from rate_limit import TokenBucketLimiter
+from dashboard_summary import DashboardSummaries
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
@@ -30,134 +40,190 @@ UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Index of uploaded images and analysis results (rebuilt at startup)
+image_index = ImageIndex(UPLOAD_FOLDER, db)
+
 # Secret key for sessions (generate a secure random key in production)
 app.secret_key = 'your_secret_key_here'  # Replace with a secure random key
 app.permanent_session_lifetime = timedelta(days=7)  # Session lasts for 7 days
 
 GEMINI_PROXY_URL = "https://gemini-proxy-447400638876.asia-southeast1.run.app/analyze-image"
 
+# Bump this whenever the proxy's model or prompt changes so cached analyses are not reused
+GEMINI_ANALYSIS_VERSION = "gemini-2.0-flash-lite/dental-v1"
+
+# Downscale/re-encode settings for images sent to Gemini
+IMAGE_MAX_DIMENSION = 1024
+IMAGE_JPEG_QUALITY = 85
+IMAGE_STRIP_EXIF = True
+image_preprocessor = ImagePreprocessor(IMAGE_MAX_DIMENSION, IMAGE_JPEG_QUALITY, IMAGE_STRIP_EXIF)
+
+# Cache of Gemini analyses keyed by image content (and how it was preprocessed)
+analysis_cache = AnalysisCache(f"{GEMINI_ANALYSIS_VERSION}/{image_preprocessor.signature()}")
+
 # Request queue for the Pi to poll
-capture_requests = []
+capture_queue = CaptureQueue()
+
+# Progress events pushed to the web UI
+event_broker = EventBroker()
+
+# Limit on concurrent calls to the Gemini proxy, shared by all analysis jobs
+GEMINI_PROXY_CONCURRENCY = 2
+
+# Gemini can take a while to answer, so allow a long read timeout
+GEMINI_PROXY_READ_TIMEOUT = 90
+
+# Pooled keep-alive clients for all outbound HTTP calls
+_proxy_url = urlparse(GEMINI_PROXY_URL)
+proxy_http = HttpClient(
+    read_timeout=GEMINI_PROXY_READ_TIMEOUT,
+    host_pool_sizes={f"{_proxy_url.scheme}://{_proxy_url.netloc}/": GEMINI_PROXY_CONCURRENCY}
+)
+# ESP32s are on the local network and either answer fast or not at all
+device_http = HttpClient(connect_timeout=1, read_timeout=2, retries=0,
+                         pool_connections=32, pool_maxsize=2)
+
+# Concurrent /health sweep for finding ESP32s on the local network
+device_discovery = DeviceDiscovery(device_http)
+
+# Cached /status + /brushing-progress snapshots, so monitor tabs don't each poll the ESP32
+device_relay = DeviceRelay(device_http)
+
+# Single client used by every analysis path to talk to the Gemini proxy
+gemini_client = GeminiClient(GEMINI_PROXY_URL, proxy_http, GEMINI_PROXY_CONCURRENCY,
+                             preprocessor=image_preprocessor)
+
+# How long an analysis job waits for the Pi to finish uploading its image
+UPLOAD_WAIT_SECONDS = 5
+
+def publish_job_update(job):
+    """Tell the job's owner that its state changed"""
+    event_broker.publish(job.get('user_id'), "job_update", {
+        "job_id": job['id'],
+        "kind": job['kind'],
+        "state": job['state']
+    })
+
+# Background jobs for slow Gemini analyses
+job_manager = JobManager(listener=publish_job_update)
 
-# Add this function somewhere before your routes
+# Statements used on every heartbeat/status poll, kept as constants so each
+# connection prepares them once and reuses them from its statement cache
+UPSERT_DEVICE_SQL = """INSERT INTO devices 
+    (device_id, ip_address, last_connection, camera_available) 
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (device_id) DO UPDATE SET
+        ip_address = excluded.ip_address,
+        last_connection = excluded.last_connection,
+        camera_available = excluded.camera_available"""
 
-def check_pi_connection():
-    """Check if the Raspberry Pi is connected and sending data
+def check_pi_connection(device_ids=(DEFAULT_DEVICE_ID,)):
+    """Check if any of the given Raspberry Pis is connected and sending data
     
-    This function checks if the Pi has communicated recently with the server.
+    A device counts as connected if it sent a heartbeat in the last 3 minutes,
+    or connected, uploaded or completed a capture in the last 5 minutes.
     Returns True if connected, False otherwise.
     """
     try:
-        # Method 1: Check if there are recent completed capture requests
-        # Consider the Pi connected if there was activity in the last 5 minutes
-        current_time = datetime.now()
-        for request in requests:
-            if request.get('status') == 'completed':
-                completed_time = datetime.fromisoformat(request.get('completed_at', ''))
-                time_diff = (current_time - completed_time).total_seconds()
-                if time_diff < 300:  # 5 minutes
-                    return True
-        
-        # Method 2: Check for recent file uploads
-        # Find the most recent image in the upload folder
-        image_files = [f for f in os.listdir(UPLOAD_FOLDER) 
-                      if f.endswith(('.jpg', '.jpeg', '.png'))]
-        
-        if image_files:
-            latest_image = max(
-                image_files,
-                key=lambda x: os.path.getmtime(os.path.join(UPLOAD_FOLDER, x))
-            )
-            # Check if the image was uploaded in the last 5 minutes
-            image_time = os.path.getmtime(os.path.join(UPLOAD_FOLDER, latest_image))
-            time_diff = time.time() - image_time
-            if time_diff < 300:  # 5 minutes
-                return True
-        
-        # Method 3 (NEW): Check for recent heartbeats
-        # Get the most recent heartbeat from database or file storage
-        latest_heartbeat = get_latest_heartbeat()  # You'll need to implement this function
-        if latest_heartbeat:
-            # Parse the timestamp from the heartbeat
-            heartbeat_time = datetime.fromisoformat(latest_heartbeat.get('timestamp', ''))
-            time_diff = (current_time - heartbeat_time).total_seconds()
-            # Consider the Pi connected if heartbeat was received in the last 3 minutes
-            # (heartbeat is sent every 2 minutes per Pi code)
-            if time_diff < 180:  # 3 minutes
-                return True
-        
-        return False
+        return any(presence.is_connected(device_id) for device_id in device_ids)
     except Exception as e:
         print(f"Error checking Pi connection: {e}")
         return False
-def get_latest_heartbeat():
-    """Retrieve the most recent heartbeat from the database"""
-    try:
-        # If using SQLite or similar
-        conn = sqlite3.connect('your_database.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM heartbeats ORDER BY timestamp DESC LIMIT 1")
-        heartbeat = cursor.fetchone()
-        conn.close()
-        
-        if heartbeat:
-            # Convert database row to dictionary
-            return {
-                'device_id': heartbeat[0],
-                'timestamp': heartbeat[1],
-                'status': heartbeat[2]
-            }
-        return None
-    except Exception as e:
-        print(f"Error retrieving latest heartbeat: {e}")
-        return None
 
 def initialize_database():
     """Create required database tables if they don't exist"""
     try:
-        conn = sqlite3.connect('your_database.db')
-        cursor = conn.cursor()
-        
-        # Create heartbeats table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS heartbeats (
-            device_id TEXT,
-            timestamp TEXT,
-            status TEXT,
-            PRIMARY KEY (device_id, timestamp)
-        )
-        ''')
-        
-        # Create devices table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_id TEXT PRIMARY KEY,
-            ip_address TEXT,
-            last_connection TEXT,
-            camera_available BOOLEAN
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with db.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Create heartbeats table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS heartbeats (
+                device_id TEXT,
+                timestamp TEXT,
+                status TEXT,
+                PRIMARY KEY (device_id, timestamp)
+            )
+            ''')
+            
+            # Create devices table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS devices (
+                device_id TEXT PRIMARY KEY,
+                ip_address TEXT,
+                last_connection TEXT,
+                camera_available BOOLEAN
+            )
+            ''')
     except Exception as e:
         print(f"Error initializing database: {e}")
 
 # Call this function during application startup
 initialize_database()
 
+# Heartbeats are buffered and written in batches, with old ones downsampled
+heartbeat_writer = HeartbeatWriter(db)
+
+# Brushing status samples from the toothbrush monitor, also written in batches
+# into packed per-session records with running rollups
+brushing_store = BrushingStore(db)
+telemetry_writer = TelemetryWriter(brushing_store)
+MAX_SAMPLES_PER_REQUEST = 1000
+
+# Last-seen table for devices, updated whenever a device contacts the server
+presence = PresenceTracker(db)
+
+# Which user each device is paired with
+device_registry = DeviceRegistry(db)
+
+# Per-user dashboard data, updated when scans are saved or deleted
+dashboard_summaries = DashboardSummaries(db, scan_manager)
+
+# Throttling for the endpoints that hash passwords, checked before any hashing
+AUTH_RATE_PER_IP = (10 / 60, 10)           # (tokens per second, burst): 10 a minute per client IP
+AUTH_RATE_PER_ACCOUNT = (5 / 300, 5)       # 5 every 5 minutes per account
+AUTH_RATE_LIMIT_SHARED = False             # Keep buckets in SQLite so all worker processes share them
+rate_limit_db = db if AUTH_RATE_LIMIT_SHARED else None
+ip_limiter = TokenBucketLimiter('ip', *AUTH_RATE_PER_IP, db=rate_limit_db)
+account_limiter = TokenBucketLimiter('account', *AUTH_RATE_PER_ACCOUNT, db=rate_limit_db)
+
+def auth_rate_limited(endpoint, account=None):
+    """Check the IP and account limits; returns seconds to wait, or None if allowed"""
+    allowed, retry_after = ip_limiter.allow(f"{endpoint}:{request.remote_addr}")
+    if allowed and account:
+        allowed, retry_after = account_limiter.allow(f"{endpoint}:{account.casefold()}")
+    return None if allowed else retry_after
+
+# Pairing codes handed to devices
+PAIRING_RATE_PER_IP = (5 / 60, 5)          # 5 a minute per client IP
+pairing_limiter = TokenBucketLimiter('pairing', *PAIRING_RATE_PER_IP, db=rate_limit_db)
+
+def device_authenticated(device_id):
+    """Check the X-Device-Secret header against the secret issued to the device"""
+    return device_registry.check_secret(device_id, request.headers.get('X-Device-Secret'))
+
+def too_many_attempts(template, retry_after, **context):
+    """Render a page with a 429 status and a Retry-After header"""
+    flash(f'Too many attempts. Please try again in {retry_after} seconds.', 'danger')
+    return render_template(template, **context), 429, {'Retry-After': str(retry_after)}
+
 # ===== Authentication Routes =====
 @app.route('/api/pi-status', methods=['GET'])
 @login_required
 def pi_status():
     """API endpoint to check the Raspberry Pi connection status"""
     try:
-        # Check if the Pi is connected
-        connected = check_pi_connection()
+        # Only the devices paired with the current user, or the default
+        # device for users who have not paired one
+        paired = set(device_registry.devices_for(session.get('user_id')))
+        
+        # Check if the user's Pi is connected
+        connected = check_pi_connection(paired or (DEFAULT_DEVICE_ID,))
         
         # Return the status as JSON
         return jsonify({
             "connected": connected,
+            "devices": [d for d in presence.devices() if d['device_id'] in paired],
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -169,49 +235,191 @@ def pi_status():
 
 @app.route('/heartbeat', methods=['POST'])
 def receive_heartbeat():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
     device_id = data.get('device_id')
     timestamp = data.get('timestamp')
     status = data.get('status')
     
-    # Store heartbeat in database
+    # Anything else would fail when the batch is written
+    if not all(value is None or isinstance(value, str) for value in (device_id, timestamp, status)):
+        return jsonify({'status': 'error', 'message': 'device_id, timestamp and status must be strings'}), 400
+    
+    # Queue the heartbeat; it is written with the next batch
     try:
-        conn = sqlite3.connect('your_database.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO heartbeats (device_id, timestamp, status) VALUES (?, ?, ?)",
-            (device_id, timestamp, status)
-        )
-        conn.commit()
-        conn.close()
+        heartbeat_writer.add(device_id, timestamp, status)
+        presence.touch(device_id, 'heartbeat', status=status)
         return jsonify({'status': 'success'}), 200
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/device-connected', methods=['POST'])
 def device_connected():
-    data = request.json
+    """Record a device connecting
+
+    A device's first connection is issued a secret, returned once as
+    device_secret. Later connections must send it in the X-Device-Secret header.
+    """
+    data = request.get_json(silent=True) or {}
     device_id = data.get('device_id')
     ip_address = data.get('ip_address')
     connection_time = data.get('connection_time')
     camera_available = data.get('camera_available', False)
     
+    if not isinstance(device_id, str) or not device_id:
+        return jsonify({'status': 'error', 'message': 'No device_id provided'}), 400
+    
+    issued = {}
+    if not device_authenticated(device_id):
+        secret = device_registry.issue_secret(device_id)
+        if secret is None:
+            return jsonify({'status': 'error', 'message': 'Invalid or missing device secret'}), 403
+        # Returned even if saving the connection fails, or the device would be locked out
+        issued['device_secret'] = secret
+    
     # Store device connection info
     try:
-        conn = sqlite3.connect('your_database.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT OR REPLACE INTO devices 
-               (device_id, ip_address, last_connection, camera_available) 
-               VALUES (?, ?, ?, ?)""",
-            (device_id, ip_address, connection_time, camera_available)
-        )
-        conn.commit()
-        conn.close()
-        return jsonify({'status': 'success'}), 200
+        db.execute(UPSERT_DEVICE_SQL, (device_id, ip_address, connection_time, camera_available))
+        presence.touch(device_id, 'connected', ip_address=ip_address)
+        return jsonify({'status': 'success', **issued}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e), **issued}), 500
+
+@app.route('/update-status', methods=['POST'])
+def update_status():
+    """Accept brushing status from the toothbrush monitor
+
+    The body is a single sample, a list of samples or {"samples": [...]}.
+    Samples are queued and written in the background.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('samples'), list):
+        samples = data['samples']
+    elif isinstance(data, dict):
+        samples = [data]
+    elif isinstance(data, list):
+        samples = data
+    else:
+        return jsonify({'status': 'error', 'message': 'Expected a JSON sample or list of samples'}), 400
+    
+    if len(samples) > MAX_SAMPLES_PER_REQUEST:
+        return jsonify({'status': 'error', 'message': f'At most {MAX_SAMPLES_PER_REQUEST} samples per request'}), 413
+    
+    try:
+        accepted = telemetry_writer.add(samples, device_id=request.remote_addr, user_id=session.get('user_id'),
+                                        client=request.remote_addr)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    return jsonify({
+        'status': 'accepted',
+        'count': len(accepted),
+        'sessions': sorted({sample['session_id'] for sample in accepted})
+    }), 202
+
+@app.route('/api/brushing/coverage', methods=['GET'])
+@login_required
+def brushing_coverage():
+    """Brushing coverage per position over the last days for the current user or one of their devices"""
+    user_id = session.get('user_id')
+    device_id = request.args.get('device_id')
+    days = request.args.get('days', COVERAGE_DAYS, type=int)
+    
+    if device_id and device_id not in device_registry.devices_for(user_id):
+        return jsonify({'status': 'error', 'message': 'Unknown device'}), 404
+    
+    try:
+        if device_id:
+            report = brushing_store.coverage(device_id=device_id, days=days)
+        else:
+            report = brushing_store.coverage(user_id=user_id, days=days)
+        return jsonify({'status': 'success', **report})
     except Exception as e:
+        print(f"Error building brushing coverage: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/brushing/sessions/<session_id>', methods=['GET'])
+@login_required
+def brushing_session(session_id):
+    """Rollup of one brushing session, with its samples if ?samples=1"""
+    include_samples = request.args.get('samples') in ('1', 'true')
+    user_id = session.get('user_id')
+    result = brushing_store.session(session_id, include_samples=include_samples)
+    # Sessions belong to the user who recorded them, or to the owner of the device
+    if not result or (result['user_id'] != user_id
+                      and result['device_id'] not in device_registry.devices_for(user_id)):
+        return jsonify({'status': 'error', 'message': 'Session not found'}), 404
+    return jsonify({'status': 'success', 'session': result})
+
+@app.route('/api/devices', methods=['GET'])
+@login_required
+def list_devices():
+    """List the devices paired with the current user and whether they are online"""
+    user_id = session.get('user_id')
+    paired = set(device_registry.devices_for(user_id))
+    devices = [d for d in presence.devices() if d['device_id'] in paired]
+
+    # Paired devices that have never contacted the server
+    seen = {d['device_id'] for d in devices}
+    devices.extend({'device_id': device_id, 'connected': False, 'last_seen': None}
+                   for device_id in sorted(paired - seen))
+
+    return jsonify({"status": "success", "devices": devices})
+
+@app.route('/api/devices/pair', methods=['POST'])
+@login_required
+def pair_device():
+    """Pair a device with the current user"""
+    data = request.get_json(silent=True) or request.form
+    device_id = data.get('device_id')
+    code = data.get('code')
+    if not device_id or not code:
+        return jsonify({"status": "error", "message": "device_id and code are required"}), 400
+
+    success, message = device_registry.pair(device_id, session.get('user_id'), code)
+    if not success:
+        return jsonify({"status": "error", "message": message}), 409
+    return jsonify({"status": "success", "message": message})
+
+@app.route('/device-pairing-code', methods=['POST'])
+def device_pairing_code():
+    """Called by a device to get a code to display; the user enters it to pair
+
+    The device must send the secret it was issued by /device-connected in
+    the X-Device-Secret header, so only the device itself ever sees the code.
+    """
+    allowed, retry_after = pairing_limiter.allow(request.remote_addr)
+    if not allowed:
+        return (jsonify({"status": "error", "message": "Too many requests"}), 429,
+                {'Retry-After': str(retry_after)})
+    
+    data = request.get_json(silent=True) or {}
+    device_id = data.get('device_id')
+    if not isinstance(device_id, str) or not device_id:
+        return jsonify({"status": "error", "message": "No device_id provided"}), 400
+    if not device_authenticated(device_id):
+        return jsonify({"status": "error", "message": "Invalid or missing device secret"}), 403
+
+    success, result = device_registry.start_pairing(device_id)
+    if not success:
+        return jsonify({"status": "error", "message": result}), 409
+    return jsonify({"status": "success", "code": result})
+
+@app.route('/api/devices/unpair', methods=['POST'])
+@login_required
+def unpair_device():
+    """Remove the current user's pairing with a device"""
+    data = request.get_json(silent=True) or request.form
+    device_id = data.get('device_id')
+    if not device_id:
+        return jsonify({"status": "error", "message": "No device_id provided"}), 400
+
+    success, message = device_registry.unpair(device_id, session.get('user_id'))
+    if not success:
+        return jsonify({"status": "error", "message": message}), 404
+    return jsonify({"status": "success", "message": message})
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -222,6 +430,10 @@ def login():
             flash('Please provide both username and password', 'danger')
             return render_template('login.html')
         
+        retry_after = auth_rate_limited('login', account=username)
+        if retry_after is not None:
+            return too_many_attempts('login.html', retry_after)
+        
         success, result = user_manager.login_user(username, password)
         
         if success:
@@ -256,6 +468,10 @@ def register():
             flash('Passwords do not match', 'danger')
             return render_template('register.html')
         
+        retry_after = auth_rate_limited('register', account=email)
+        if retry_after is not None:
+            return too_many_attempts('register.html', retry_after)
+        
         # Register the user
         success, result = user_manager.register_user(username, email, password)
         
@@ -268,6 +484,16 @@ def register():
     
     return render_template('register.html')
 
+@app.route('/api/rate-limits', methods=['GET'])
+@api_login_required
+def rate_limit_stats():
+    """Counters of allowed and throttled login, registration and password change attempts"""
+    return jsonify({
+        'status': 'success',
+        'ip': ip_limiter.stats(),
+        'account': account_limiter.stats()
+    })
+
 @app.route('/logout')
 def logout():
     clear_session()
@@ -278,43 +504,12 @@ def logout():
 @login_required
 def dashboard():
     user_id = session.get('user_id')
-    # Get user scans
-    user_scans = scan_manager.get_user_scans(user_id)
-    
-    # Process scans for display
-    scan_history = []
-    for scan in user_scans:
-        # Format timestamp
-        timestamp = datetime.fromisoformat(scan['timestamp'])
-        formatted_date = timestamp.strftime("%b %d, %Y %I:%M %p")
-        
-        # Get analysis status
-        status = "Unknown"
-        status_class = "unknown"
-        if 'analysis' in scan and 'status' in scan['analysis']:
-            status = scan['analysis']['status']
-            
-            # Map status to CSS class
-            if status == "Good":
-                status_class = "good"
-            elif status == "Needs improvement":
-                status_class = "warning"
-            elif status == "Attention needed":
-                status_class = "danger"
-        
-        # Add to scan history
-        scan_history.append({
-            'id': scan['id'],
-            'date': formatted_date,
-            'status': status,
-            'status_class': status_class,
-        })
     
-    # Get user stats
-    stats = scan_manager.get_user_stats(user_id)
-    
-    # Get user's most recent recommendations
-    recommendations = scan_manager.get_recent_recommendations(user_id)
+    # Scan history, stats and recommendations come precomputed in one record
+    summary = dashboard_summaries.get(user_id)
+    scan_history = summary['history']
+    stats = summary['stats']
+    recommendations = summary['recommendations']
     
     return render_template('dashboard.html', 
                           scan_history=scan_history, 
@@ -377,13 +572,18 @@ def change_password():
     
     # Verify current password
     user = user_manager.get_user(user_id)
-    stored_password = {
-        'salt': bytes.fromhex(user['password']['salt']),
-        'key': bytes.fromhex(user['password']['key'])
-    }
+    retry_after = auth_rate_limited('change-password', account=user_id)
+    if retry_after is not None:
+        return too_many_attempts('account.html', retry_after, user=user)
     
-    from auth import verify_password
-    if not verify_password(stored_password, current_password):
+    stored_password = load_password(user['password'])
+    
+    try:
+        password_ok = verify_password(stored_password, current_password)
+    except PasswordHasherBusy:
+        flash('Server is busy, please try again', 'danger')
+        return redirect(url_for('account'))
+    if not password_ok:
         flash('Current password is incorrect', 'danger')
         return redirect(url_for('account'))
     
@@ -505,6 +705,7 @@ def delete_scan(scan_id):
     success = scan_manager.delete_scan(user_id, scan_id)
     
     if success:
+        dashboard_summaries.scan_deleted(user_id, scan_id)
         flash('Scan deleted successfully', 'success')
     else:
         flash('Failed to delete scan', 'danger')
@@ -540,6 +741,18 @@ def save_scan():
     success, result = scan_manager.save_scan(user_id, analysis_data, file_path)
     
     if success:
+        # Keep the dashboard summary current; it is rebuilt if this fails
+        try:
+            scan = scan_manager.get_scan(user_id, result) or {
+                'id': result,
+                'timestamp': datetime.now().isoformat(),
+                'analysis': analysis_data
+            }
+            dashboard_summaries.scan_saved(user_id, scan)
+        except Exception as e:
+            print(f"Error updating dashboard summary: {e}")
+            dashboard_summaries.invalidate(user_id)
+        
         return jsonify({
             'status': 'success',
             'scan_id': result,
@@ -567,241 +780,311 @@ def index():
 @app.route('/capture-only', methods=['POST'])
 @login_required
 def capture_only():
-    """Queue a capture request for the Pi"""
-    request_id = str(int(time.time()))
-    
-    # Add to queue
-    capture_requests.append({
-        "id": request_id,
-        "timestamp": datetime.now().isoformat(),
-        "status": "pending"
-    })
+    """Queue a capture request for one of the user's devices
+
+    Pass device_id (form field or JSON) to pick a device. Without it the
+    request goes to the user's only paired device, or to the default queue
+    if the user has not paired any device.
+    """
+    user_id = session.get('user_id')
+    data = request.get_json(silent=True) or request.form
+    device_id = data.get('device_id')
+    paired_devices = device_registry.devices_for(user_id)
+
+    if device_id:
+        if device_id not in paired_devices:
+            return jsonify({"status": "error", "message": "Device is not paired with your account"}), 403
+    elif len(paired_devices) == 1:
+        device_id = paired_devices[0]
+    elif paired_devices:
+        return jsonify({"status": "error", "message": "Several devices are paired, please choose one"}), 400
+    else:
+        device_id = DEFAULT_DEVICE_ID
+
+    request_id = uuid.uuid4().hex
+    
+    # Add to the device's queue
+    if capture_queue.add(request_id, user_id=user_id, device_id=device_id) is None:
+        return jsonify({"status": "error", "message": "Duplicate capture request id"}), 409
     
     return jsonify({
         "status": "success",
         "message": "Capture request queued",
-        "request_id": request_id
+        "request_id": request_id,
+        "device_id": device_id
     })
 
 @app.route('/check-requests', methods=['GET'])
 def check_requests():
-    """Endpoint for the Pi to check for pending requests"""
+    """Endpoint for the Pi to check for pending requests
+
+    Pass ?device_id=<id> to get only the requests for that device (devices
+    that do not identify themselves share the default queue), and ?wait=N to
+    long-poll: the request is held for up to N seconds until a capture
+    request is queued, instead of returning immediately.
+    """
+    device_id = request.args.get('device_id') or DEFAULT_DEVICE_ID
+    wait = request.args.get('wait', default=0, type=float)
+
     # Look for pending requests
-    for request in capture_requests:
-        if request.get("status") == "pending":
-            return jsonify({
-                "has_requests": True,
-                "request": request
-            })
+    if wait > 0:
+        pending = capture_queue.wait_for_pending(wait, device_id=device_id)
+    else:
+        pending = capture_queue.next_pending(device_id=device_id)
+    if pending:
+        return jsonify({
+            "has_requests": True,
+            "request": pending
+        })
     
     # No pending requests
     return jsonify({"has_requests": False})
 
 @app.route('/mark-complete', methods=['POST'])
 def mark_complete():
+    """Mark a capture request complete and queue its image for analysis"""
     data = request.json
     request_id = data.get('request_id')
 
-    for req in capture_requests:
-        if req.get("id") == request_id:
-            req["status"] = "completed"
-            req["completed_at"] = datetime.now().isoformat()
-
-            time.sleep(1)  # Wait for image to finish uploading
-
-            image_filename = req.get("filename")
-            if not image_filename:
-                return jsonify({"status": "error", "message": "Image filename not yet available"}), 400
-
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, image_filename)
-                with open(file_path, "rb") as f:
-                    encoded_image = base64.b64encode(f.read()).decode('utf-8')
-
-                payload = {
-                    "image_url": f"data:image/jpeg;base64,{encoded_image}"
-                }
+    req = capture_queue.mark_completed(request_id)
+    if not req:
+        return jsonify({"status": "error", "message": "Request not found"}), 404
 
-                response = requests.post(GEMINI_PROXY_URL, json=payload)
-                gemini_response = response.json().get("response", "")
-                structured = json.loads(gemini_response) if isinstance(gemini_response, str) else gemini_response
+    presence.touch(data.get('device_id') or req.get('device_id') or DEFAULT_DEVICE_ID, 'capture')
 
-                analysis = structured
+    try:
+        job = job_manager.submit("capture-analysis", analyze_capture, request_id,
+                                 user_id=req.get("user_id"))
+    except JobQueueFull as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+
+    return jsonify({"status": "success", "job_id": job["id"]}), 202
+
+def analyze_capture(request_id):
+    """Job: send the image of a completed capture request to Gemini"""
+    # The Pi may still be uploading the image when it marks the request complete
+    deadline = time.time() + UPLOAD_WAIT_SECONDS
+    req = capture_queue.get(request_id)
+    while req and not req.get("filename") and time.time() < deadline:
+        time.sleep(0.2)
+        req = capture_queue.get(request_id)
+
+    if not req or not req.get("filename"):
+        raise ValueError("Image filename not yet available")
+
+    image_filename = req["filename"]
+    user_id = req.get("user_id")
+    event_broker.publish(user_id, "analysis_started", {
+        "request_id": request_id,
+        "filename": image_filename
+    })
 
-                result_path = os.path.join(UPLOAD_FOLDER, f"{image_filename}.json")
-                with open(result_path, 'w') as f:
-                    json.dump({
-                        "filename": image_filename,
-                        "timestamp": datetime.now().isoformat(),
-                        "raw_detections": structured,
-                        "analysis": analysis
-                    }, f)
-            except Exception as e:
-                return jsonify({"status": "error", "message": f"Gemini analysis error: {str(e)}"}), 500
+    try:
+        file_path = os.path.join(UPLOAD_FOLDER, image_filename)
+        analysis = analyze_image_file(file_path, image_filename)
+    except Exception as e:
+        event_broker.publish(user_id, "analysis_failed", {
+            "request_id": request_id,
+            "filename": image_filename,
+            "message": str(e)
+        })
+        raise ValueError(f"Gemini analysis error: {str(e)}")
 
-            return jsonify({"status": "success"})
+    event_broker.publish(user_id, "analysis_done", {
+        "request_id": request_id,
+        "filename": image_filename
+    })
 
-    return jsonify({"status": "error", "message": "Request not found"}), 404
+    return analysis
 
 @app.route('/get-latest-image', methods=['GET'])
 @login_required
 def get_latest_image():
     """Get the latest uploaded image"""
-    # Check completed requests
-    completed_requests = [r for r in capture_requests if r.get('status') == 'completed']
+    # Find the latest completed request
+    latest_request = capture_queue.latest_completed()
     
-    if not completed_requests:
+    if not latest_request:
         return jsonify({"status": "waiting", "message": "No completed captures yet"})
     
-    # Find the latest completed request
-    latest_request = max(completed_requests, key=lambda x: x.get('completed_at', ''))
-    
     # Find the most recent image
-    image_files = [f for f in os.listdir(UPLOAD_FOLDER) 
-                   if f.endswith(('.jpg', '.jpeg', '.png'))]
+    latest_image = image_index.latest_image()
     
-    if not image_files:
+    if not latest_image:
         return jsonify({"status": "error", "message": "No images found"})
     
-    # Get the most recent file
-    latest_image = max(
-        image_files, 
-        key=lambda x: os.path.getmtime(os.path.join(UPLOAD_FOLDER, x))
-    )
-    
     return jsonify({
         "status": "success",
-        "filename": latest_image,
+        "filename": latest_image['filename'],
         "request_id": latest_request.get('id')
     })
 @app.route('/analyze-image', methods=['POST'])
 @login_required
 def analyze_image():
+    """Queue an analysis of an image
+
+    The image can be uploaded as the multipart 'image' field, or, when it is
+    already on the server, named by a 'filename' or 'request_id' (form field
+    or JSON) so the browser does not have to send it back. With none of
+    these the latest capture is analyzed.
+
+    Returns a job id straight away; poll /jobs/<job_id> or listen for
+    job_update events to get the result.
+    """
     try:
-        # Get the image file from the request
-        if 'image' not in request.files:
-            # If no file in request, try to get the latest image
-            completed_requests = [r for r in capture_requests if r.get('status') == 'completed']
-            if not completed_requests:
-                print("❌ No completed captures yet")
-                return jsonify({"error": "No completed captures yet"}), 400
-
-            latest_request = max(completed_requests, key=lambda x: x.get('completed_at', ''))
-            image_files = [f for f in os.listdir(UPLOAD_FOLDER) if f.endswith(('.jpg', '.jpeg', '.png'))]
-            if not image_files:
-                print("❌ No images found")
-                return jsonify({"error": "No images found"}), 400
-
-            latest_image = max(image_files, key=lambda x: os.path.getmtime(os.path.join(UPLOAD_FOLDER, x)))
-            file_path = os.path.join(UPLOAD_FOLDER, latest_image)
-
-            print(f"🔸 Sending latest image for analysis: {file_path}")
-            with open(file_path, "rb") as img:
-                image_data = img.read()
-                current_filename = latest_image
-        else:
+        if 'image' in request.files:
             # Use the image file from the request
             image_file = request.files['image']
             image_data = image_file.read()
             current_filename = image_file.filename
 
-        print(f"🔸 Sending image to Gemini proxy")
-        
-        # Create a multipart/form-data request to the Gemini proxy
-        files = {"image": ("image.jpg", image_data, "image/jpeg")}
-        response = requests.post(GEMINI_PROXY_URL, files=files)
-
-        print("🔨 Proxy status code:", response.status_code)
-        print("🔨 Proxy raw response:", response.text)
+            job = job_manager.submit("image-analysis", analyze_image_data, image_data,
+                                     current_filename, user_id=session.get('user_id'))
+        else:
+            # Use an image that is already on the server
+            params = request.get_json(silent=True) or request.form
+            current_filename, error = find_server_image(params.get('filename'),
+                                                        params.get('request_id'))
+            if error:
+                print(f"❌ {error}")
+                return jsonify({"error": error}), 400
 
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to analyze image"}), 500
+            file_path = os.path.join(UPLOAD_FOLDER, current_filename)
+            print(f"🔸 Sending stored image for analysis: {file_path}")
 
-        try:
-            response_data = response.json()
-        except ValueError:
-            return jsonify({"error": "Invalid JSON response from Gemini proxy"}), 500
+            job = job_manager.submit("image-analysis", analyze_image_file, file_path,
+                                     current_filename, user_id=session.get('user_id'))
 
-        if "response" not in response_data:
-            return jsonify({"error": "Failed to get proper analysis data from server"}), 500
-
-        # Extract the predictions and recommendations
-        gemini_data = response_data["response"]
-        
-        # Process predictions to generate detection counts and confidences
-        detection_counts = {}
-        confidences = {}
-        
-        if "predictions" in gemini_data:
-            for pred in gemini_data["predictions"]:
-                class_name = pred["class"].replace("-like", "").replace("-looking", "")
-                if class_name not in detection_counts:
-                    detection_counts[class_name] = 0
-                    confidences[class_name] = 0
-                
-                detection_counts[class_name] += 1
-                confidences[class_name] = max(confidences[class_name], pred["confidence"] * 100)
-        
-        # Determine overall status based on detections
-        status = "Unknown"
-        primary_issue = "No specific issues detected"
-        
-        if "caries" in detection_counts and detection_counts["caries"] > 0:
-            status = "Attention needed"
-            primary_issue = f"Detected {detection_counts['caries']} potential cavity areas"
-        elif "plaque" in detection_counts and detection_counts["plaque"] > 0:
-            status = "Needs improvement"
-            primary_issue = f"Detected {detection_counts['plaque']} areas with potential plaque buildup"
-        elif "healthy" in detection_counts and detection_counts["healthy"] > 0:
-            status = "Good"
-            primary_issue = "Your teeth appear to be in good condition"
-        
-        # Enhance the response with processed data
-        enhanced_data = {
-            "predictions": gemini_data.get("predictions", []),
-            "recommendations": gemini_data.get("recommendations", []),
-            "detection_counts": detection_counts,
-            "confidences": confidences,
-            "status": status,
-            "primary_issue": primary_issue,
-            "filename": current_filename
-        }
-        
-        # Save the result to a JSON file for later retrieval
-        result_path = os.path.join(UPLOAD_FOLDER, f"{current_filename}.json")
-        with open(result_path, 'w') as f:
-            json.dump({
-                "filename": current_filename,
-                "timestamp": datetime.now().isoformat(),
-                "raw_detections": gemini_data,
-                "analysis": enhanced_data
-            }, f)
-        
-        return jsonify({"response": enhanced_data})
+        return jsonify({"status": "queued", "job_id": job["id"]}), 202
 
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print("⚠️ Exception:", str(e))
         return jsonify({"error": str(e)}), 500
 
+def find_server_image(filename=None, request_id=None):
+    """Find an uploaded image by filename, capture request id, or the latest capture
+
+    Returns a (filename, error message) tuple.
+    """
+    if filename:
+        # Only allow files directly inside the upload folder
+        filename = os.path.basename(filename)
+    elif request_id:
+        req = capture_queue.get(request_id)
+        record = image_index.find_by_request_id(request_id)
+        filename = (req and req.get("filename")) or (record and record['filename'])
+        if not filename:
+            return None, "No image uploaded for this request"
+    else:
+        if not capture_queue.latest_completed():
+            return None, "No completed captures yet"
+
+        latest_image = image_index.latest_image()
+        if not latest_image:
+            return None, "No images found"
+        filename = latest_image['filename']
+
+    if not os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+        return None, "Image file not found"
+
+    return filename, None
+
+def analyze_image_data(image_data, current_filename):
+    """Job: send image bytes to Gemini and save the processed analysis"""
+    # Reuse the earlier analysis if this exact image was analyzed before
+    cache_key = analysis_cache.key_for(image_data)
+    gemini_data = analysis_cache.get(cache_key)
+
+    if gemini_data is None:
+        gemini_data = gemini_client.analyze(image_data, current_filename)
+        analysis_cache.put(cache_key, gemini_data)
+    else:
+        print(f"🔸 Using cached Gemini analysis for {current_filename}")
+
+    return save_analysis(gemini_data, current_filename)
+
+def analyze_image_file(file_path, current_filename):
+    """Job: send an image stored on the server to Gemini and save the processed analysis"""
+    cache_key = analysis_cache.key_for_file(file_path)
+    gemini_data = analysis_cache.get(cache_key)
+
+    if gemini_data is None:
+        # The client streams the file from disk instead of reading it up front
+        gemini_data = gemini_client.analyze(file_path, current_filename)
+        analysis_cache.put(cache_key, gemini_data)
+    else:
+        print(f"🔸 Using cached Gemini analysis for {current_filename}")
+
+    return save_analysis(gemini_data, current_filename)
+
+def save_analysis(gemini_data, current_filename):
+    """Derive counts and overall status from Gemini's predictions and save the result"""
+    # Process predictions to generate detection counts and confidences
+    detection_counts = {}
+    confidences = {}
+    
+    if "predictions" in gemini_data:
+        for pred in gemini_data["predictions"]:
+            class_name = pred["class"].replace("-like", "").replace("-looking", "")
+            if class_name not in detection_counts:
+                detection_counts[class_name] = 0
+                confidences[class_name] = 0
+            
+            detection_counts[class_name] += 1
+            confidences[class_name] = max(confidences[class_name], pred["confidence"] * 100)
+    
+    # Determine overall status based on detections
+    status = "Unknown"
+    primary_issue = "No specific issues detected"
+    
+    if "caries" in detection_counts and detection_counts["caries"] > 0:
+        status = "Attention needed"
+        primary_issue = f"Detected {detection_counts['caries']} potential cavity areas"
+    elif "plaque" in detection_counts and detection_counts["plaque"] > 0:
+        status = "Needs improvement"
+        primary_issue = f"Detected {detection_counts['plaque']} areas with potential plaque buildup"
+    elif "healthy" in detection_counts and detection_counts["healthy"] > 0:
+        status = "Good"
+        primary_issue = "Your teeth appear to be in good condition"
+    
+    # Enhance the response with processed data
+    enhanced_data = {
+        "predictions": gemini_data.get("predictions", []),
+        "recommendations": gemini_data.get("recommendations", []),
+        "detection_counts": detection_counts,
+        "confidences": confidences,
+        "status": status,
+        "primary_issue": primary_issue,
+        "filename": current_filename
+    }
+    
+    # Save the result to a JSON file for later retrieval
+    result_path = os.path.join(UPLOAD_FOLDER, f"{current_filename}.json")
+    with open(result_path, 'w') as f:
+        json.dump({
+            "filename": current_filename,
+            "timestamp": datetime.now().isoformat(),
+            "raw_detections": gemini_data,
+            "analysis": enhanced_data
+        }, f)
+    image_index.record_result(current_filename, result_path)
+    
+    return enhanced_data
+
 @app.route('/get-analysis', methods=['GET'])
 @login_required
 def get_analysis():
     """Get the analysis results for the most recent image"""
     # Find the most recent result file
-    result_files = [f for f in os.listdir(UPLOAD_FOLDER) if f.endswith('.json')]
+    latest_result = image_index.latest_result()
     
-    if not result_files:
+    if not latest_result:
         return jsonify({"status": "error", "message": "No analysis results found"}), 404
-    
-    # Get the most recent file
-    latest_result = max(
-        result_files, 
-        key=lambda x: os.path.getmtime(os.path.join(UPLOAD_FOLDER, x))
-    )
-    
 
     try:
-        with open(os.path.join(UPLOAD_FOLDER, latest_result), 'r') as f:
+        with open(latest_result['result_path'], 'r') as f:
             result = json.load(f)
         
         return jsonify({
@@ -825,14 +1108,19 @@ def upload():
 
     file_path = os.path.join(UPLOAD_FOLDER, file.filename)
     file.save(file_path)
+    presence.touch(request.form.get('device_id') or DEFAULT_DEVICE_ID, 'upload')
 
     # âœ… Match request and store filename
     request_id = request.form.get("request_id")
-    if request_id:
-        for req in capture_requests:
-            if req.get("id") == request_id:
-                req["filename"] = file.filename
-                break
+    req = capture_queue.set_filename(request_id, file.filename) if request_id else None
+    image_index.record_upload(file.filename,
+                              owner=req.get("user_id") if req else None,
+                              request_id=request_id)
+    if req:
+        event_broker.publish(req.get("user_id"), "image_uploaded", {
+            "request_id": request_id,
+            "filename": file.filename
+        })
 
     return jsonify({
         "status": "success",
@@ -841,12 +1129,117 @@ def upload():
     })
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    """Get the state and result of a background job"""
+    job = job_manager.get(job_id)
+
+    # Only the user who started a job may see it
+    if not job or job.get('user_id') != session.get('user_id'):
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+
+    job.pop('user_id', None)
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/api/analysis-cache', methods=['GET', 'DELETE'])
+@login_required
+def analysis_cache_admin():
+    """Get analysis cache counters, or invalidate cached analyses
+
+    DELETE with ?filename=<name> drops the cached analysis of one uploaded
+    image; without it the whole cache is cleared.
+    """
+    if request.method == 'DELETE':
+        filename = request.args.get('filename')
+        if filename:
+            file_path = os.path.join(UPLOAD_FOLDER, os.path.basename(filename))
+            if not os.path.exists(file_path):
+                return jsonify({"status": "error", "message": "Image file not found"}), 404
+            analysis_cache.invalidate(analysis_cache.key_for_file(file_path))
+        else:
+            analysis_cache.clear()
+
+    return jsonify({"status": "success", "stats": analysis_cache.stats()})
+
+@app.route('/events')
+@login_required
+def events():
+    """Server-Sent Events stream of capture and analysis progress for the current user"""
+    user_id = session.get('user_id')
+
+    response = Response(
+        stream_with_context(event_broker.stream(user_id)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+
 @app.route('/toothbrush_monitor')
 @login_required
 def toothbrush_monitor():
     """Serve the toothbrush monitor page"""
     return render_template('toothbrush_monitor.html')
 
+def resolve_device_address(device_id, user_id):
+    """Get the recorded address of one of the user's devices
+
+    device_id is a device paired with the user, or the name an ESP32 was
+    recorded under by /api/get_device_ip for this user. Addresses that were
+    never recorded for the user are not relayed to.
+    """
+    if device_id in device_registry.devices_for(user_id):
+        address = device_registry.cached_address(device_id)
+    else:
+        address = device_registry.cached_address(esp32_device_id(user_id, device_id))
+    return local_address(address) if address else None
+
+@app.route('/api/device/<device_id>/snapshot', methods=['GET'])
+@api_login_required
+def device_snapshot(device_id):
+    """Combined status and brushing progress of an ESP32, served from the relay cache"""
+    address = resolve_device_address(device_id, session.get('user_id'))
+    if not address:
+        return jsonify({"status": "error", "message": "Unknown device"}), 404
+    
+    snapshot = device_relay.snapshot(address)
+    if not snapshot['reachable'] and not snapshot['stale']:
+        return jsonify({"status": "error", "message": "Device did not respond"}), 502
+    
+    response = jsonify({
+        "status": "success",
+        "device": address,
+        "stale": snapshot['stale'],
+        "updated_at": datetime.fromtimestamp(snapshot['updated_at']).isoformat(),
+        **snapshot['data']
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    if snapshot['stale']:
+        # Never let a client revalidate stale data into a 304
+        return response
+    response.set_etag(snapshot['etag'])
+    return response.make_conditional(request)
+
+@app.route('/api/device/address', methods=['POST'])
+@api_login_required
+def record_device_address():
+    """Record the address the monitor page connected to, so the snapshot relay polls that host
+
+    The address is checked with a single /health probe; the network is never swept.
+    """
+    data = request.get_json(silent=True) or {}
+    ip = data.get('ip')
+    address = local_address(ip) if isinstance(ip, str) else None
+    if not address:
+        return jsonify({"status": "error", "message": "Not a local network address"}), 400
+    if not device_discovery.probe(address):
+        return jsonify({"status": "error", "message": "Device did not respond"}), 502
+    
+    device_registry.record_address(esp32_device_id(session.get('user_id'), address), address)
+    return jsonify({"status": "success", "ip": address})
+
 # API endpoint to get the device's IP on the local network
 @app.route('/api/get_device_ip', methods=['POST'])
 @login_required
@@ -860,44 +1253,40 @@ def get_device_ip():
     # The ESP32's previous IP from its access point
     esp_ap_ip = data['espIp']
     
+    # Addresses are remembered per user, under the name the browser gives the device
+    device_id = esp32_device_id(session.get('user_id'), data.get('deviceId') or 'default')
+    
     try:
-        # First, try to get the new IP from the device itself
+        # Fast path: the address recorded last time, checked with a single probe
+        cached_ip = device_registry.cached_address(device_id)
+        if cached_ip and device_discovery.probe(cached_ip):
+            device_registry.record_address(device_id, cached_ip)
+            return jsonify({"status": "success", "ip": cached_ip})
+        
+        # Next, try to get the new IP from the device itself
         # This might not work if the device has already disconnected from its AP
         try:
             # Try with a short timeout as this likely won't work
-            response = requests.get(f"http://{esp_ap_ip}/ip", timeout=2)
+            response = device_http.get(f"http://{esp_ap_ip}/ip", timeout=2)
             if response.status_code == 200:
                 # If the device has a special endpoint that returns its new IP
-                new_ip = response.text.strip()
-                return jsonify({"status": "success", "ip": new_ip})
+                new_ip = local_address(response.text)
+                if new_ip:
+                    device_registry.record_address(device_id, new_ip)
+                    return jsonify({"status": "success", "ip": new_ip})
         except:
             pass  # Expected to fail, continue with other methods
         
-        # Option 1: Try to scan the network for the ESP32
-        # This is a simple implementation - a proper one would use nmap or similar
-        # Attempt to get the base network for scanning
-        interface = get_active_interface()
-        if not interface or not interface['addr'] or not interface['netmask']:
-            return jsonify({"status": "error", "message": "Could not determine network details"}), 500
-        
-        # Determine network subnet
-        network_base = get_network_base(interface['addr'], interface['netmask'])
-        if not network_base:
-            return jsonify({"status": "error", "message": "Could not determine network subnet"}), 500
-        
-        # Scan the network for ESP32 devices
-        candidates = scan_for_esp32(network_base)
+        # Option 1: Sweep the local network for the ESP32
+        try:
+            ip = device_discovery.find_device()
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
         
-        if candidates:
-            # Try each candidate IP to see if our device responds
-            for ip in candidates:
-                try:
-                    response = requests.get(f"http://{ip}/health", timeout=1)
-                    if response.status_code == 200:
-                        # Found our device!
-                        return jsonify({"status": "success", "ip": ip})
-                except:
-                    continue  # Try the next candidate
+        if ip:
+            # Found our device!
+            device_registry.record_address(device_id, ip)
+            return jsonify({"status": "success", "ip": ip})
         
         # If we can't automatically detect it, let the user know
         return jsonify({
@@ -908,77 +1297,6 @@ def get_device_ip():
     except Exception as e:
         return jsonify({"status": "error", "message": f"Error finding device: {str(e)}"}), 500
 
-def get_active_interface():
-    """Get the active network interface details"""
-    try:
-        # This is a simple implementation that works for most cases
-        # A proper implementation would use netifaces or similar
-        # Use socket to get the hostname and IP address
-        hostname = socket.gethostname()
-        ip_address = socket.gethostbyname(hostname)
-        
-        # For simplicity, assume a /24 subnet mask (255.255.255.0)
-        # A proper implementation would get the actual netmask
-        netmask = "255.255.255.0"
-        
-        return {
-            "name": hostname,
-            "addr": ip_address,
-            "netmask": netmask
-        }
-    except Exception as e:
-        print(f"Error getting network interface: {e}")
-        return None
-
-def get_network_base(ip, netmask):
-    """Get the network base address for scanning"""
-    try:
-        # Convert IP and netmask to integer representation
-        ip_parts = list(map(int, ip.split('.')))
-        mask_parts = list(map(int, netmask.split('.')))
-        
-        # Calculate network base address
-        base_parts = [ip_parts[i] & mask_parts[i] for i in range(4)]
-        
-        # Return as string
-        return '.'.join(map(str, base_parts))
-    except Exception as e:
-        print(f"Error calculating network base: {e}")
-        return None
-
-def scan_for_esp32(network_base):
-    """Scan for potential ESP32 devices on the network"""
-    candidates = []
-    
-    # For simplicity, we'll only try the first 20 addresses
-    # A proper implementation would scan more thoroughly
-    network_prefix = '.'.join(network_base.split('.')[:3]) + '.'
-    
-    for i in range(1, 21):  # Just check the first 20 IPs
-        ip = f"{network_prefix}{i}"
-        
-        # Skip the gateway address (usually .1)
-        if i == 1:
-            continue
-            
-        # Try a simple ping to see if the device is alive
-        try:
-            # Use a very short timeout for ping
-            result = subprocess.run(
-                ["ping", "-c", "1", "-W", "0.2", ip],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=0.5
-            )
-            
-            if result.returncode == 0:
-                # Device responded to ping, add to candidates
-                candidates.append(ip)
-        except:
-            continue  # Ignore errors and continue
-    
-    return candidates
-
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """Serve uploaded files"""
@@ -1,11 +1,18 @@
 import os
 import json
+import hmac
 import uuid
+import sqlite3
 import hashlib
 import datetime
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from functools import wraps
 from flask import request, redirect, url_for, session, flash, jsonify
 
+from database import db
+
 # Configuration
 DATA_FOLDER = 'user_data'
 USER_DATA_FILE = 'users.json'
@@ -14,82 +21,338 @@ USER_DATA_FILE = 'users.json'
 if not os.path.exists(DATA_FOLDER):
     os.makedirs(DATA_FOLDER)
 
+# Password hashing
+# KDF used for new hashes; stored hashes made with other settings are
+# upgraded on the next successful login
+KDF_ALGORITHM = 'pbkdf2_sha256'  # or 'scrypt'
+KDF_PARAMS = {
+    'pbkdf2_sha256': {'iterations': 100000},
+    'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1}
+}
+# Hashes stored before the algorithm was recorded
+LEGACY_KDF = ('pbkdf2_sha256', {'iterations': 100000})
+
+KDF_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Processes hashing passwords (0 hashes inline)
+KDF_MAX_PENDING = KDF_WORKERS * 8                # Hashes running or queued at once
+KDF_WAIT_TIMEOUT = 5                             # Seconds to wait for a free slot
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many passwords are already being hashed"""
+
+def _derive_key(algorithm, params, password, salt):
+    """Run the KDF (in a worker process)"""
+    if algorithm == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024)
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params['iterations'])
+    raise ValueError(f"Unknown password hashing algorithm: {algorithm}")
+
+class PasswordHasher:
+    """Runs password hashing in a small process pool
+
+    Request threads only wait for the result, so the KDF's CPU cost is
+    capped at max_workers cores. At most max_pending hashes run or wait at
+    once; beyond that, callers get PasswordHasherBusy after wait_timeout
+    seconds instead of queueing without limit.
+    """
+    
+    def __init__(self, algorithm=KDF_ALGORITHM, params=None, max_workers=KDF_WORKERS,
+                 max_pending=KDF_MAX_PENDING, wait_timeout=KDF_WAIT_TIMEOUT):
+        self.algorithm = algorithm
+        self.params = dict(params or KDF_PARAMS[algorithm])
+        self.max_workers = max_workers
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def _pool(self):
+        # Started on first use rather than at import
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+    
+    def derive(self, algorithm, params, password, salt):
+        """Derive a key, waiting for a free slot in the pool"""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PasswordHasherBusy("Too many password checks in progress")
+        try:
+            password = password.encode('utf-8')
+            if self.max_workers <= 0:
+                return _derive_key(algorithm, params, password, salt)
+            try:
+                return self._pool().submit(_derive_key, algorithm, params, password, salt).result()
+            except BrokenProcessPool:
+                with self._lock:
+                    self._executor = None
+                raise PasswordHasherBusy("Password hashing pool restarted")
+        finally:
+            self._slots.release()
+    
+    def hash(self, password, salt=None):
+        """Hash a password with the current settings"""
+        if salt is None:
+            salt = os.urandom(32)  # Generate a random salt
+        key = self.derive(self.algorithm, self.params, password, salt)
+        return {
+            'salt': salt,
+            'key': key,
+            'algorithm': self.algorithm,
+            'params': dict(self.params)
+        }
+    
+    def verify(self, stored_password, provided_password):
+        """Check a password against a stored hash in constant time"""
+        algorithm = stored_password.get('algorithm') or LEGACY_KDF[0]
+        params = stored_password.get('params') or LEGACY_KDF[1]
+        key = self.derive(algorithm, params, provided_password, stored_password['salt'])
+        return hmac.compare_digest(key, stored_password['key'])
+    
+    def needs_rehash(self, stored_password):
+        """Whether a stored hash was made with settings other than the current ones"""
+        algorithm = stored_password.get('algorithm') or LEGACY_KDF[0]
+        params = stored_password.get('params') or LEGACY_KDF[1]
+        return algorithm != self.algorithm or params != self.params
+
+password_hasher = PasswordHasher()
+
 # Helper to hash passwords
 def hash_password(password, salt=None):
-    if salt is None:
-        salt = os.urandom(32)  # Generate a random salt
-    
-    # Hash the password with the salt
-    key = hashlib.pbkdf2_hmac(
-        'sha256',
-        password.encode('utf-8'),
-        salt,
-        100000  # Number of iterations
-    )
-    
-    # Return the salt and key
-    return {
-        'salt': salt,
-        'key': key
-    }
+    return password_hasher.hash(password, salt)
 
 # Verify password
 def verify_password(stored_password, provided_password):
-    salt = stored_password['salt']
-    stored_key = stored_password['key']
-    
-    # Hash the provided password with the stored salt
-    hashed = hash_password(provided_password, salt)
-    
-    # Compare the generated key with the stored key
-    return hashed['key'] == stored_key
+    return password_hasher.verify(stored_password, provided_password)
+
+# Stored form of a password hash (bytes as hex, for JSON)
+def serialize_password(password_hash):
+    return {
+        'salt': password_hash['salt'].hex(),
+        'key': password_hash['key'].hex(),
+        'algorithm': password_hash['algorithm'],
+        'params': password_hash['params']
+    }
+
+# Convert a stored password hash back to bytes
+def load_password(serialized_password):
+    return {
+        'salt': bytes.fromhex(serialized_password['salt']),
+        'key': bytes.fromhex(serialized_password['key']),
+        'algorithm': serialized_password.get('algorithm'),
+        'params': serialized_password.get('params')
+    }
+
+# Key used for case-insensitive username and email lookups
+def _index_key(value):
+    return value.casefold() if isinstance(value, str) else None
+
+CREATE_USERS_SQL = '''
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT,
+    email TEXT,
+    username_key TEXT UNIQUE,
+    email_key TEXT UNIQUE,
+    password TEXT,
+    created_at TEXT,
+    last_login TEXT
+)
+'''
+INSERT_USER_SQL = '''
+INSERT INTO users (id, username, email, username_key, email_key, password, created_at, last_login)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+UPDATE_LAST_LOGIN_SQL = "UPDATE users SET last_login = ? WHERE id = ?"
+UPDATE_LOGIN_REHASH_SQL = "UPDATE users SET last_login = ?, password = ? WHERE id = ?"
+# Users already in the table are skipped when migrating; users whose
+# username or email clashes with another user's abort the migration
+MIGRATE_USER_SQL = INSERT_USER_SQL.replace('INSERT INTO', 'INSERT OR IGNORE INTO')
+
+# Every write to users also appends the user's id to this journal, so
+# other worker processes know which cached users to reload
+USER_JOURNAL_SIZE = 10000  # Journal entries kept; workers further behind reload everything
+CREATE_USER_CHANGES_SQL = '''
+CREATE TABLE IF NOT EXISTS user_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT
+)
+'''
+LOG_USER_CHANGE_SQL = "INSERT INTO user_changes (user_id) VALUES (?)"
+PRUNE_USER_CHANGES_SQL = "DELETE FROM user_changes WHERE seq <= ? - ?"
 
 # User management
 class UserManager:
-    def __init__(self):
+    """Users stored one row each in the users table of the shared database
+
+    Every change is a single-row INSERT or UPDATE; a login only updates
+    last_login. The unique username_key and email_key columns hold the
+    casefolded username and email. Users are cached in memory with
+    dict indexes on the same keys for lookups.
+    
+    Several worker processes can share the database: each write is logged
+    in the user_changes journal, and every public method first reloads
+    just the users changed since the last journal entry this process saw.
+    """
+    
+    def __init__(self, db=db):
+        self.db = db
         self.users_file = os.path.join(DATA_FOLDER, USER_DATA_FILE)
+        with self.db.transaction() as conn:
+            conn.execute(CREATE_USERS_SQL)
+            conn.execute(CREATE_USER_CHANGES_SQL)
+        self._migrate_json()
+        self._lock = threading.RLock()
+        self._seen = 0  # Last journal entry applied to the cache
         # Initialize local cache
-        self.users = self._load_users()
+        self.users = {}
+        # Casefolded username / email -> user id
+        self._by_username = {}
+        self._by_email = {}
+        self._reload_all()
     
-    def _load_users(self):
-        """Load users from local file"""
+    def _last_change(self):
+        row = self.db.query_one("SELECT max(seq) AS seq FROM user_changes")
+        return row['seq'] or 0
+    
+    def _reload_all(self):
+        """Load every user and rebuild the indexes"""
+        with self._lock:
+            self._seen = self._last_change()
+            self.users = self._load_users()
+            self._rebuild_indexes()
+    
+    def refresh(self):
+        """Apply changes other processes made since the last refresh"""
         try:
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r') as f:
-                    return json.load(f)
-            else:
-                # Create an empty users file
-                with open(self.users_file, 'w') as f:
-                    json.dump({}, f)
-                return {}
+            rows = self.db.query_all("SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq",
+                                     (self._seen,))
         except Exception as e:
-            print(f"Error loading users: {e}")
-            return {}
+            print(f"Error checking for user changes: {e}")
+            return
+        if not rows:
+            return
+        
+        # Entries we never saw were pruned from the journal
+        if rows[0]['seq'] > self._seen + 1:
+            self._reload_all()
+            return
+        
+        with self._lock:
+            for user_id in {row['user_id'] for row in rows}:
+                self._reload_user(user_id)
+            self._seen = max(self._seen, rows[-1]['seq'])
+    
+    def _reload_user(self, user_id):
+        row = self.db.query_one("SELECT * FROM users WHERE id = ?", (user_id,))
+        old = self.users.pop(user_id, None)
+        if old:
+            self._unindex_user(user_id, old)
+        if row:
+            self.users[user_id] = self._user_from_row(row)
+            self._index_user(user_id, self.users[user_id])
     
-    def _save_users(self):
-        """Save users to local file"""
+    def _write(self, sql, params, user_id):
+        """Run a write to one user's row and log it in the journal, in one transaction"""
+        with self.db.transaction() as conn:
+            conn.execute(sql, params)
+            seq = conn.execute(LOG_USER_CHANGE_SQL, (user_id,)).lastrowid
+            conn.execute(PRUNE_USER_CHANGES_SQL, (seq, USER_JOURNAL_SIZE))
+    
+    def _rebuild_indexes(self):
+        """Index every loaded user by casefolded username and email"""
+        self._by_username = {}
+        self._by_email = {}
+        for user_id, user in self.users.items():
+            self._index_user(user_id, user)
+    
+    def _index_user(self, user_id, user):
+        self._by_username[_index_key(user['username'])] = user_id
+        self._by_email[_index_key(user['email'])] = user_id
+    
+    def _unindex_user(self, user_id, user):
+        if self._by_username.get(_index_key(user['username'])) == user_id:
+            del self._by_username[_index_key(user['username'])]
+        if self._by_email.get(_index_key(user['email'])) == user_id:
+            del self._by_email[_index_key(user['email'])]
+    
+    def _migrate_json(self):
+        """Copy users from the old users.json file into the users table, once"""
+        if not os.path.exists(self.users_file):
+            return
+        
         try:
-            with open(self.users_file, 'w') as f:
-                json.dump(self.users, f)
-            return True
+            with open(self.users_file, 'r') as f:
+                users = json.load(f)
+            
+            with self.db.transaction() as conn:
+                migrated = 0
+                conflicts = []
+                for user in users.values():
+                    cursor = conn.execute(MIGRATE_USER_SQL, self._row_for(user))
+                    migrated += cursor.rowcount
+                    if not cursor.rowcount and not conn.execute("SELECT 1 FROM users WHERE id = ?",
+                                                                (user['id'],)).fetchone():
+                        conflicts.append(user['username'])
+                
+                if conflicts:
+                    # Roll back and keep users.json until the clashes are resolved by hand
+                    raise ValueError(f"usernames or emails differing only in case: {', '.join(conflicts)}")
+            
+            # Keep the old file, but make sure it is never imported again
+            os.replace(self.users_file, self.users_file + '.migrated')
+            print(f"Migrated {migrated} of {len(users)} users from {self.users_file}")
         except Exception as e:
-            print(f"Error saving users: {e}")
-            return False
+            print(f"Error migrating users: {e}")
+    
+    def _row_for(self, user):
+        return (
+            user['id'],
+            user['username'],
+            user['email'],
+            _index_key(user['username']),
+            _index_key(user['email']),
+            json.dumps(user['password']),
+            user.get('created_at'),
+            user.get('last_login')
+        )
+    
+    def _user_from_row(self, row):
+        return {
+            'id': row['id'],
+            'username': row['username'],
+            'email': row['email'],
+            'password': json.loads(row['password']),
+            'created_at': row['created_at'],
+            'last_login': row['last_login']
+        }
+    
+    def _load_users(self):
+        """Load users from the database"""
+        try:
+            rows = self.db.query_all("SELECT * FROM users")
+            return {row['id']: self._user_from_row(row) for row in rows}
+        except Exception as e:
+            print(f"Error loading users: {e}")
+            return {}
     
     def register_user(self, username, email, password):
         """Register a new user"""
+        self.refresh()
+        
         # Check if user exists
         if self._get_user_by_username(username) or self._get_user_by_email(email):
             return False, "Username or email already exists"
         
         # Hash the password
-        password_hash = hash_password(password)
+        try:
+            password_hash = hash_password(password)
+        except PasswordHasherBusy:
+            return False, "Server is busy, please try again"
         
         # Convert bytes to strings for JSON serialization
-        serialized_password = {
-            'salt': password_hash['salt'].hex(),
-            'key': password_hash['key'].hex()
-        }
+        serialized_password = serialize_password(password_hash)
         
         # Create user object
         user = {
@@ -101,19 +364,25 @@ class UserManager:
             'last_login': None
         }
         
-        # Add to users dictionary
-        self.users[user['id']] = user
-        
         # Save to storage
-        if self._save_users():
-            return True, user['id']
-        else:
-            # Remove from local cache if save failed
-            del self.users[user['id']]
+        try:
+            self._write(INSERT_USER_SQL, self._row_for(user), user['id'])
+        except sqlite3.IntegrityError:
+            return False, "Username or email already exists"
+        except Exception as e:
+            print(f"Error saving user: {e}")
             return False, "Failed to save user data"
+        
+        # Add to users dictionary
+        with self._lock:
+            self.users[user['id']] = user
+            self._index_user(user['id'], user)
+        return True, user['id']
     
     def login_user(self, username_or_email, password):
         """Login a user by username or email"""
+        self.refresh()
+        
         # Find user by username or email
         user = self._get_user_by_username(username_or_email) or self._get_user_by_email(username_or_email)
         
@@ -121,62 +390,96 @@ class UserManager:
             return False, "User not found"
         
         # Convert stored password back to bytes
-        stored_password = {
-            'salt': bytes.fromhex(user['password']['salt']),
-            'key': bytes.fromhex(user['password']['key'])
-        }
+        stored_password = load_password(user['password'])
         
         # Verify password
-        if verify_password(stored_password, password):
-            # Update last login
-            user['last_login'] = datetime.datetime.now().isoformat()
-            self._save_users()
+        try:
+            if not verify_password(stored_password, password):
+                return False, "Invalid password"
             
-            return True, user
+            # Upgrade hashes made with older KDF settings while we have the password
+            new_password = None
+            if password_hasher.needs_rehash(stored_password):
+                new_password = serialize_password(hash_password(password))
+        except PasswordHasherBusy:
+            return False, "Server is busy, please try again"
+        
+        # Update last login
+        user['last_login'] = datetime.datetime.now().isoformat()
+        try:
+            if new_password:
+                self._write(UPDATE_LOGIN_REHASH_SQL, (user['last_login'], json.dumps(new_password), user['id']), user['id'])
+                user['password'] = new_password
+            else:
+                self._write(UPDATE_LAST_LOGIN_SQL, (user['last_login'], user['id']), user['id'])
+        except Exception as e:
+            print(f"Error saving last login: {e}")
         
-        return False, "Invalid password"
+        return True, user
     
     def get_user(self, user_id):
         """Get user by ID"""
+        self.refresh()
         return self.users.get(user_id)
     
     def _get_user_by_username(self, username):
-        """Find user by username"""
-        for user_id, user in self.users.items():
-            if user['username'].lower() == username.lower():
-                return user
-        return None
+        """Find user by username (case-insensitive)"""
+        user_id = self._by_username.get(_index_key(username))
+        return self.users.get(user_id) if user_id else None
     
     def _get_user_by_email(self, email):
-        """Find user by email"""
-        for user_id, user in self.users.items():
-            if user['email'].lower() == email.lower():
-                return user
-        return None
+        """Find user by email (case-insensitive)"""
+        user_id = self._by_email.get(_index_key(email))
+        return self.users.get(user_id) if user_id else None
     
     def update_user(self, user_id, data):
         """Update user data"""
+        self.refresh()
         if user_id not in self.users:
             return False, "User not found"
         
-        # Update allowed fields
+        # Usernames and emails must stay unique
+        if 'username' in data and self._by_username.get(_index_key(data['username']), user_id) != user_id:
+            return False, "Username already exists"
+        if 'email' in data and self._by_email.get(_index_key(data['email']), user_id) != user_id:
+            return False, "Email already exists"
+        
+        # Work out the changed columns
+        changes = {}
         for field in ['email', 'username']:
             if field in data:
-                self.users[user_id][field] = data[field]
+                changes[field] = data[field]
+                changes[f'{field}_key'] = _index_key(data[field])
         
         # Update password if provided
         if 'password' in data and data['password']:
-            password_hash = hash_password(data['password'])
-            self.users[user_id]['password'] = {
-                'salt': password_hash['salt'].hex(),
-                'key': password_hash['key'].hex()
-            }
+            try:
+                changes['password'] = serialize_password(hash_password(data['password']))
+            except PasswordHasherBusy:
+                return False, "Server is busy, please try again"
         
-        # Save changes
-        if self._save_users():
+        if not changes:
             return True, "User updated"
-        else:
+        
+        # Save changes
+        columns = ', '.join(f"{column} = ?" for column in changes)
+        values = [json.dumps(value) if column == 'password' else value for column, value in changes.items()]
+        try:
+            self._write(f"UPDATE users SET {columns} WHERE id = ?", (*values, user_id), user_id)
+        except sqlite3.IntegrityError:
+            return False, "Username or email already exists"
+        except Exception as e:
+            print(f"Error saving user: {e}")
             return False, "Failed to save changes"
+        
+        with self._lock:
+            user = self.users[user_id]
+            self._unindex_user(user_id, user)
+            for field in ['email', 'username', 'password']:
+                if field in changes:
+                    user[field] = changes[field]
+            self._index_user(user_id, user)
+        return True, "User updated"
 
 # Initialize the user manager
 user_manager = UserManager()
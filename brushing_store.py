@@ -0,0 +1,293 @@
+import struct
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Configuration
+MAX_CACHED_SESSIONS = 1024   # Rollups of recently active sessions kept in memory
+COVERAGE_DAYS = 30
+
+# Brushing positions, in the order of the positionProgress array
+POSITIONS = (
+    'UPPER_FRONT', 'UPPER_LEFT', 'UPPER_RIGHT',
+    'LOWER_FRONT', 'LOWER_LEFT', 'LOWER_RIGHT',
+    'FRONT_MIDDLE', 'FRONT_LEFT', 'FRONT_RIGHT'
+)
+COMPLETE = 100  # Progress of a fully brushed position
+
+# One sample, 18 bytes: milliseconds since the session started, flags
+# (bit 0 active, bit 1 paused), current position index (-1 if unknown),
+# total brushing seconds, completed positions and progress per position.
+SAMPLE = struct.Struct('<IBbHB' + 'B' * len(POSITIONS))
+FLAG_ACTIVE = 1
+FLAG_PAUSED = 2
+
+SAVE_SESSION_SQL = '''
+INSERT INTO brushing_sessions (
+    session_id, device_id, user_id, started_at, ended_at, sample_count, total_seconds,
+    completed_positions, completion_seconds, pause_count, paused_seconds, coverage, samples
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id) DO UPDATE SET
+    user_id = coalesce(excluded.user_id, user_id),
+    ended_at = excluded.ended_at,
+    sample_count = excluded.sample_count,
+    total_seconds = excluded.total_seconds,
+    completed_positions = excluded.completed_positions,
+    completion_seconds = excluded.completion_seconds,
+    pause_count = excluded.pause_count,
+    paused_seconds = excluded.paused_seconds,
+    coverage = excluded.coverage,
+    samples = CAST(samples || excluded.samples AS BLOB)
+'''
+LOAD_ROLLUP_SQL = '''
+SELECT session_id, device_id, user_id, started_at, ended_at, sample_count, total_seconds,
+       completed_positions, completion_seconds, pause_count, paused_seconds, coverage,
+       substr(samples, -{size}) AS last_sample
+FROM brushing_sessions WHERE session_id = ?
+'''.format(size=SAMPLE.size)
+
+
+def position_index(name):
+    """Index of a position name, or -1 if it is not a known position"""
+    try:
+        return POSITIONS.index(name)
+    except ValueError:
+        return -1
+
+
+def _clamp(value, upper):
+    return min(max(int(value), 0), upper)
+
+
+def unpack_samples(blob, started_at):
+    """Decode a session's packed samples"""
+    samples = []
+    for offset_ms, flags, position, total_seconds, completed, *progress in SAMPLE.iter_unpack(blob or b''):
+        samples.append({
+            'timestamp': started_at + offset_ms / 1000,
+            'brushing_active': bool(flags & FLAG_ACTIVE),
+            'brushing_paused': bool(flags & FLAG_PAUSED),
+            'current_position': POSITIONS[position] if position >= 0 else None,
+            'total_seconds': total_seconds,
+            'completed_positions': completed,
+            'position_progress': progress
+        })
+    return samples
+
+
+class BrushingStore:
+    """Brushing sessions stored as packed samples plus running rollups
+
+    Each session is one row of brushing_sessions. Its samples are appended
+    to a blob of fixed-width SAMPLE records, and the rollups (best coverage
+    per position, brushing time to completion, pauses) are updated as the
+    samples arrive, so reports read one small row per session instead of
+    decoding samples.
+    """
+
+    def __init__(self, db, max_cached_sessions=MAX_CACHED_SESSIONS):
+        self.db = db
+        self.max_cached_sessions = max_cached_sessions
+        self._lock = threading.Lock()
+        self._rollups = OrderedDict()  # session id -> rollup dict, most recent last
+
+        self._create_tables()
+        self._migrate_samples()
+
+    def _create_tables(self):
+        with self.db.transaction() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS brushing_sessions (
+                session_id TEXT PRIMARY KEY,
+                device_id TEXT,
+                user_id TEXT,
+                started_at REAL,
+                ended_at REAL,
+                sample_count INTEGER,
+                total_seconds INTEGER,
+                completed_positions INTEGER,
+                completion_seconds INTEGER,
+                pause_count INTEGER,
+                paused_seconds REAL,
+                coverage BLOB,
+                samples BLOB
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_brushing_sessions_user "
+                         "ON brushing_sessions (user_id, started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_brushing_sessions_device "
+                         "ON brushing_sessions (device_id, started_at)")
+
+    def _migrate_samples(self):
+        """Move samples from the old one-row-per-sample table into sessions"""
+        exists = self.db.query_one("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'brushing_samples'")
+        if not exists:
+            return
+
+        rows = self.db.query_all("SELECT * FROM brushing_samples ORDER BY session_id, timestamp")
+        self.append([(
+            row['device_id'], row['session_id'], None, row['timestamp'],
+            row['brushing_active'], row['brushing_paused'], position_index(row['current_position']),
+            row['total_seconds'], row['completed_positions'],
+            [int(value) for value in (row['position_progress'] or '').split(',') if value]
+        ) for row in rows])
+        self.db.execute("DROP TABLE brushing_samples")
+        print(f"Moved {len(rows)} brushing samples into brushing_sessions")
+
+    def append(self, rows):
+        """Store samples and update their sessions' rollups in one transaction
+
+        Each row is (device_id, session_id, user_id, timestamp, active, paused,
+        position index, total_seconds, completed_positions, progress list).
+        """
+        by_session = OrderedDict()
+        for row in rows:
+            by_session.setdefault(row[1], []).append(row)
+
+        with self._lock:
+            updates = []
+            for session_id, session_rows in by_session.items():
+                session_rows.sort(key=lambda row: row[3])
+                rollup = self._rollup(session_id, session_rows[0])
+                packed = b''.join(self._add_sample(rollup, row) for row in session_rows)
+                updates.append((
+                    session_id, rollup['device_id'], rollup['user_id'], rollup['started_at'],
+                    rollup['ended_at'], rollup['sample_count'], rollup['total_seconds'],
+                    rollup['completed_positions'], rollup['completion_seconds'], rollup['pause_count'],
+                    rollup['paused_seconds'], bytes(rollup['coverage']), packed
+                ))
+
+            try:
+                self.db.executemany(SAVE_SESSION_SQL, updates)
+            except Exception:
+                # The cached rollups now run ahead of the database; reload them next time
+                for session_id in by_session:
+                    self._rollups.pop(session_id, None)
+                raise
+
+        return len(updates)
+
+    def _rollup(self, session_id, first_row):
+        """Get a session's running rollup (called with the lock held)"""
+        rollup = self._rollups.get(session_id)
+        if rollup is not None:
+            self._rollups.move_to_end(session_id)
+            return rollup
+
+        row = self.db.query_one(LOAD_ROLLUP_SQL, (session_id,))
+        if row:
+            last = SAMPLE.unpack(row['last_sample']) if len(row['last_sample'] or b'') == SAMPLE.size else None
+            rollup = dict(row)
+            rollup['coverage'] = bytearray(row['coverage'] or bytes(len(POSITIONS)))
+            rollup['last_paused'] = bool(last and last[1] & FLAG_PAUSED)
+            del rollup['last_sample']
+        else:
+            device_id, _, user_id, timestamp = first_row[:4]
+            rollup = {
+                'session_id': session_id,
+                'device_id': device_id,
+                'user_id': user_id,
+                'started_at': timestamp,
+                'ended_at': timestamp,
+                'sample_count': 0,
+                'total_seconds': 0,
+                'completed_positions': 0,
+                'completion_seconds': None,
+                'pause_count': 0,
+                'paused_seconds': 0.0,
+                'coverage': bytearray(len(POSITIONS)),
+                'last_paused': False
+            }
+
+        self._rollups[session_id] = rollup
+        while len(self._rollups) > self.max_cached_sessions:
+            self._rollups.popitem(last=False)
+        return rollup
+
+    def _add_sample(self, rollup, row):
+        """Fold one sample into a rollup and return its packed record"""
+        _, _, user_id, timestamp, active, paused, position, total_seconds, completed, progress = row
+
+        if paused and not rollup['last_paused']:
+            rollup['pause_count'] += 1
+        if rollup['last_paused']:
+            rollup['paused_seconds'] += max(timestamp - rollup['ended_at'], 0)
+
+        progress = [_clamp(value, 255) for value in progress[:len(POSITIONS)]]
+        progress += [0] * (len(POSITIONS) - len(progress))
+        for i, value in enumerate(progress):
+            rollup['coverage'][i] = max(rollup['coverage'][i], value)
+
+        total_seconds = _clamp(total_seconds, 0xFFFF)
+        completed = _clamp(completed, len(POSITIONS))
+        rollup['user_id'] = rollup['user_id'] or user_id
+        rollup['ended_at'] = max(rollup['ended_at'], timestamp)
+        rollup['sample_count'] += 1
+        rollup['total_seconds'] = max(rollup['total_seconds'], total_seconds)
+        rollup['completed_positions'] = max(rollup['completed_positions'], completed)
+        rollup['last_paused'] = bool(paused)
+        if rollup['completion_seconds'] is None and min(progress) >= COMPLETE:
+            rollup['completion_seconds'] = total_seconds
+
+        flags = (FLAG_ACTIVE if active else 0) | (FLAG_PAUSED if paused else 0)
+        offset_ms = _clamp((timestamp - rollup['started_at']) * 1000, 0xFFFFFFFF)
+        return SAMPLE.pack(offset_ms, flags, position, total_seconds, completed, *progress)
+
+    def session(self, session_id, include_samples=False):
+        """Get a session's rollup (and optionally its samples), or None"""
+        row = self.db.query_one("SELECT * FROM brushing_sessions WHERE session_id = ?", (session_id,))
+        if not row:
+            return None
+
+        result = {key: row[key] for key in row.keys() if key not in ('coverage', 'samples')}
+        result['coverage'] = dict(zip(POSITIONS, row['coverage'] or bytes(len(POSITIONS))))
+        if include_samples:
+            result['samples'] = unpack_samples(row['samples'], row['started_at'])
+        return result
+
+    def coverage(self, user_id=None, device_id=None, days=COVERAGE_DAYS):
+        """Brushing coverage per position over the last few days
+
+        Reads only the per-session rollups for the user's (or device's)
+        sessions in the window.
+        """
+        since = (datetime.now() - timedelta(days=days)).timestamp()
+        if device_id is not None:
+            rows = self.db.query_all("SELECT started_at, coverage, completion_seconds FROM brushing_sessions "
+                                     "WHERE device_id = ? AND started_at >= ? ORDER BY started_at",
+                                     (device_id, since))
+        else:
+            rows = self.db.query_all("SELECT started_at, coverage, completion_seconds FROM brushing_sessions "
+                                     "WHERE user_id = ? AND started_at >= ? ORDER BY started_at",
+                                     (user_id, since))
+
+        totals = [0] * len(POSITIONS)
+        completed = [0] * len(POSITIONS)
+        daily = OrderedDict()
+        completion_times = []
+        for row in rows:
+            coverage = row['coverage'] or bytes(len(POSITIONS))
+            day = datetime.fromtimestamp(row['started_at']).date().isoformat()
+            entry = daily.setdefault(day, {'day': day, 'sessions': 0, 'coverage': [0] * len(POSITIONS)})
+            entry['sessions'] += 1
+            for i, value in enumerate(coverage):
+                value = min(value, COMPLETE)
+                totals[i] += value
+                completed[i] += value >= COMPLETE
+                entry['coverage'][i] = max(entry['coverage'][i], value)
+            if row['completion_seconds'] is not None:
+                completion_times.append(row['completion_seconds'])
+
+        sessions = len(rows)
+        return {
+            'days': days,
+            'sessions': sessions,
+            'average_completion_seconds': (sum(completion_times) / len(completion_times)
+                                           if completion_times else None),
+            'positions': [{
+                'position': name,
+                'average_coverage': round(totals[i] / sessions, 1) if sessions else 0,
+                'completed_sessions': completed[i]
+            } for i, name in enumerate(POSITIONS)],
+            'daily': list(daily.values())
+        }
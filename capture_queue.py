@@ -0,0 +1,173 @@
+import time
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime
+
+# Configuration
+MAX_FINISHED_REQUESTS = 500      # Keep at most this many completed requests
+FINISHED_REQUEST_TTL = 60 * 60   # Drop completed requests after an hour
+MAX_WAIT_SECONDS = 30            # Longest a poll may wait for a new request
+DEFAULT_DEVICE_ID = 'default'    # Queue used for devices that do not identify themselves
+
+
+class CaptureQueue:
+    """Capture requests queued for the Pis
+
+    Requests are stored by id, with a separate FIFO of pending ids for each
+    device and a pointer to the latest completed request, so none of the
+    routes have to scan the whole request history and a device's poll never
+    looks at other devices' requests. Completed requests are evicted once
+    they are older than the TTL or there are too many of them.
+
+    Adding a request notifies that device's condition variable, so pollers
+    can block in wait_for_pending() instead of polling in a tight loop.
+    A device's condition and pending FIFO are dropped as soon as nobody is
+    waiting on it and nothing is pending, so polling with arbitrary device
+    ids does not grow the queue.
+    """
+
+    def __init__(self, max_finished=MAX_FINISHED_REQUESTS, finished_ttl=FINISHED_REQUEST_TTL):
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+
+        self._lock = threading.Lock()
+        self._new_request = {}         # device id -> condition sharing the lock
+        self._waiters = {}             # device id -> number of pollers waiting on its condition
+        self._requests = {}            # request id -> request dict
+        self._pending = {}             # device id -> request ids in the order they were queued
+        self._finished = OrderedDict() # request id -> completion time, oldest first
+        self._latest_completed = None  # id of the most recently completed request
+
+    def add(self, request_id, user_id=None, device_id=DEFAULT_DEVICE_ID):
+        """Queue a new pending capture request for a device
+
+        user_id records who asked for the capture, so progress events for
+        the request can be sent to that user. Returns None without changing
+        anything if a request with this id already exists.
+        """
+        req = {
+            "id": request_id,
+            "timestamp": datetime.now().isoformat(),
+            "status": "pending",
+            "user_id": user_id,
+            "device_id": device_id
+        }
+
+        with self._lock:
+            if request_id in self._requests:
+                return None
+            self._requests[request_id] = req
+            self._pending.setdefault(device_id, deque()).append(request_id)
+            condition = self._new_request.get(device_id)
+            if condition is not None:
+                condition.notify_all()
+            return dict(req)
+
+    def get(self, request_id):
+        """Get a copy of a request by id"""
+        with self._lock:
+            req = self._requests.get(request_id)
+            return dict(req) if req else None
+
+    def next_pending(self, device_id=DEFAULT_DEVICE_ID):
+        """Get the oldest request for a device that is still pending"""
+        with self._lock:
+            return self._next_pending(device_id)
+
+    def wait_for_pending(self, timeout, device_id=DEFAULT_DEVICE_ID):
+        """Wait up to timeout seconds for a pending request for a device
+
+        Returns the oldest pending request, or None if none arrived in time.
+        """
+        timeout = max(0, min(timeout, MAX_WAIT_SECONDS))
+        deadline = time.monotonic() + timeout
+
+        with self._lock:
+            req = self._next_pending(device_id)
+            if req is not None or timeout == 0:
+                return req
+
+            condition = self._new_request.get(device_id)
+            if condition is None:
+                condition = self._new_request[device_id] = threading.Condition(self._lock)
+            self._waiters[device_id] = self._waiters.get(device_id, 0) + 1
+            try:
+                while req is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+                    req = self._next_pending(device_id)
+            finally:
+                # The last poller to leave drops the device's condition
+                self._waiters[device_id] -= 1
+                if not self._waiters[device_id]:
+                    del self._waiters[device_id]
+                    del self._new_request[device_id]
+            return req
+
+    def _next_pending(self, device_id):
+        """Find the oldest pending request for a device
+
+        Must be called with the lock held.
+        """
+        pending = self._pending.get(device_id)
+
+        # Completed or evicted requests are dropped lazily from the front
+        while pending:
+            req = self._requests.get(pending[0])
+            if req and req.get("status") == "pending":
+                return dict(req)
+            pending.popleft()
+
+        self._pending.pop(device_id, None)
+        return None
+
+    def set_filename(self, request_id, filename):
+        """Attach the uploaded image filename to a request and return a copy of it"""
+        with self._lock:
+            req = self._requests.get(request_id)
+            if not req:
+                return None
+            req["filename"] = filename
+            return dict(req)
+
+    def mark_completed(self, request_id):
+        """Mark a request as completed and return a copy of it"""
+        with self._lock:
+            req = self._requests.get(request_id)
+            if not req:
+                return None
+
+            req["status"] = "completed"
+            req["completed_at"] = datetime.now().isoformat()
+
+            self._finished.pop(request_id, None)
+            self._finished[request_id] = time.time()
+            self._latest_completed = request_id
+
+            self._evict()
+            return dict(req)
+
+    def latest_completed(self):
+        """Get the most recently completed request"""
+        with self._lock:
+            req = self._requests.get(self._latest_completed)
+            return dict(req) if req else None
+
+    def _evict(self):
+        """Drop completed requests that are too old or over the size limit
+
+        Must be called with the lock held.
+        """
+        cutoff = time.time() - self.finished_ttl
+
+        # The latest completed request is always the newest entry, so
+        # keeping at least one entry keeps the latest-completed pointer valid
+        while len(self._finished) > 1:
+            request_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and len(self._finished) <= self.max_finished:
+                break
+
+            self._finished.popitem(last=False)
+            self._requests.pop(request_id, None)
@@ -0,0 +1,153 @@
+import json
+import threading
+from datetime import datetime
+
+# Configuration
+RECENT_HISTORY = 20  # Scans listed on the dashboard
+
+STATUS_CLASSES = {
+    "Good": "good",
+    "Needs improvement": "warning",
+    "Attention needed": "danger"
+}
+# Used to compare the latest scans when working out the health trend
+STATUS_SCORES = {
+    "Good": 2,
+    "Needs improvement": 1,
+    "Attention needed": 0
+}
+
+SAVE_SUMMARY_SQL = '''
+INSERT INTO dashboard_summaries (user_id, summary, updated_at) VALUES (?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at
+'''
+
+
+def format_scan(scan):
+    """The dashboard's history entry for a scan"""
+    timestamp = datetime.fromisoformat(scan['timestamp'])
+    status = scan.get('analysis', {}).get('status', "Unknown")
+    return {
+        'id': scan['id'],
+        'date': timestamp.strftime("%b %d, %Y %I:%M %p"),
+        'timestamp': scan['timestamp'],
+        'status': status,
+        'status_class': STATUS_CLASSES.get(status, "unknown")
+    }
+
+
+def health_trend(history):
+    """Compare the latest scan with the one before it"""
+    scores = [STATUS_SCORES[entry['status']] for entry in history[:2] if entry['status'] in STATUS_SCORES]
+    if len(scores) < 2:
+        return "N/A"
+    if scores[0] > scores[1]:
+        return "Improving"
+    if scores[0] < scores[1]:
+        return "Declining"
+    return "Stable"
+
+
+class DashboardSummaries:
+    """Per-user dashboard data kept up to date as scans are saved and deleted
+
+    The dashboard reads one row of dashboard_summaries instead of loading
+    and formatting every scan. A user's summary is built from scan_manager
+    the first time it is needed, then updated by scan_saved and
+    scan_deleted.
+    """
+
+    def __init__(self, db, scan_manager, recent=RECENT_HISTORY):
+        self.db = db
+        self.scan_manager = scan_manager
+        self.recent = recent
+        self._lock = threading.Lock()
+
+        self.db.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT,
+            updated_at TEXT
+        )
+        ''')
+
+    def get(self, user_id):
+        """Get a user's summary, building it on first use"""
+        row = self.db.query_one("SELECT summary FROM dashboard_summaries WHERE user_id = ?", (user_id,))
+        if row:
+            return json.loads(row['summary'])
+        with self._lock:
+            return self._rebuild(user_id)
+
+    def scan_saved(self, user_id, scan):
+        """Add a newly saved scan to the user's summary"""
+        with self._lock:
+            summary = self._load(user_id)
+            if summary is None:
+                self._rebuild(user_id)
+                return
+
+            entry = format_scan(scan)
+            history = [entry] + [item for item in summary['history'] if item['id'] != entry['id']]
+            history.sort(key=lambda item: item['timestamp'], reverse=True)
+            summary['history'] = history[:self.recent]
+            summary['total_scans'] += 1
+            if summary['history'][0]['id'] == entry['id']:
+                summary['recommendations'] = scan.get('analysis', {}).get('recommendations', [])
+            self._finish(user_id, summary)
+
+    def scan_deleted(self, user_id, scan_id):
+        """Remove a deleted scan from the user's summary"""
+        with self._lock:
+            summary = self._load(user_id)
+            if summary is None:
+                self._rebuild(user_id)
+                return
+
+            history = summary['history']
+            was_latest = bool(history) and history[0]['id'] == scan_id
+            summary['history'] = [item for item in history if item['id'] != scan_id]
+            summary['total_scans'] = max(summary['total_scans'] - 1, 0)
+
+            # The latest scan's recommendations, or the history slice, can only
+            # be refilled from the scans themselves
+            if was_latest or len(summary['history']) < min(summary['total_scans'], self.recent):
+                self._rebuild(user_id)
+                return
+            self._finish(user_id, summary)
+
+    def invalidate(self, user_id):
+        """Drop a user's summary so the next read rebuilds it"""
+        try:
+            self.db.execute("DELETE FROM dashboard_summaries WHERE user_id = ?", (user_id,))
+        except Exception as e:
+            print(f"Error dropping dashboard summary: {e}")
+
+    def _load(self, user_id):
+        row = self.db.query_one("SELECT summary FROM dashboard_summaries WHERE user_id = ?", (user_id,))
+        return json.loads(row['summary']) if row else None
+
+    def _rebuild(self, user_id):
+        """Build a user's summary from all of their scans"""
+        scans = sorted(self.scan_manager.get_user_scans(user_id),
+                       key=lambda scan: scan['timestamp'], reverse=True)
+        summary = {
+            'total_scans': len(scans),
+            'history': [format_scan(scan) for scan in scans[:self.recent]],
+            'recommendations': scans[0].get('analysis', {}).get('recommendations', []) if scans else []
+        }
+        return self._finish(user_id, summary)
+
+    def _finish(self, user_id, summary):
+        """Recompute the derived stats and save the summary"""
+        history = summary['history']
+        summary['stats'] = {
+            'total_scans': summary['total_scans'],
+            'last_scan': history[0]['date'] if history else "Never",
+            'health_trend': health_trend(history)
+        }
+        try:
+            self.db.execute(SAVE_SUMMARY_SQL, (user_id, json.dumps(summary), datetime.now().isoformat()))
+        except Exception as e:
+            print(f"Error saving dashboard summary: {e}")
+        return summary
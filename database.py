@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Configuration
+DATABASE = 'your_database.db'
+BUSY_TIMEOUT_MS = 5000       # How long a writer waits for the lock before failing
+CACHED_STATEMENTS = 256      # Prepared statements kept per connection
+CACHE_SIZE_KB = 8 * 1024     # Page cache per connection
+
+
+class Database:
+    """Shared SQLite access layer
+
+    Each thread keeps its own connection open and reuses it, instead of
+    connecting and closing around every statement. Connections run in WAL
+    mode with synchronous=NORMAL, so readers do not block the writer and a
+    commit does not wait for a full fsync of the database. SQL strings are
+    prepared once per connection and reused from sqlite3's statement cache.
+    """
+
+    def __init__(self, path=DATABASE, busy_timeout_ms=BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    def connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout_ms / 1000,
+                cached_statements=CACHED_STATEMENTS
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements in one transaction
+
+        Commits when the block finishes and rolls back if it raises.
+        """
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def execute(self, sql, params=()):
+        """Run a single statement in its own transaction"""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        """Run a statement for every set of parameters in one transaction"""
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    def query_one(self, sql, params=()):
+        """Fetch the first row of a query, or None"""
+        return self.connection().execute(sql, params).fetchone()
+
+    def query_all(self, sql, params=()):
+        """Fetch every row of a query"""
+        return self.connection().execute(sql, params).fetchall()
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Initialize the shared database
+db = Database()
@@ -0,0 +1,120 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Configuration
+POLL_INTERVAL = 1.0        # Poll each device at most once per interval
+MAX_DEVICES = 256          # Snapshots kept in memory
+MAX_WORKERS = 16
+RESOURCES = {
+    'device_status': '/status',
+    'progress': '/brushing-progress'
+}
+
+
+class DeviceRelay:
+    """Caches a merged /status + /brushing-progress snapshot per ESP32
+
+    Viewers read the cached snapshot instead of polling the device. Once
+    the snapshot is older than poll_interval, the next reader refreshes it
+    and fetches both resources concurrently. Readers arriving during a
+    refresh wait for its result instead of starting their own, so a device
+    is polled at most once per interval however many viewers it has.
+    """
+
+    def __init__(self, http_client, poll_interval=POLL_INTERVAL, max_devices=MAX_DEVICES,
+                 max_workers=MAX_WORKERS):
+        self.http = http_client
+        self.poll_interval = poll_interval
+        self.max_devices = max_devices
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='device-relay')
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()  # address -> snapshot dict, most recent last
+        self._refreshing = {}            # address -> Event set when the refresh finishes
+        self._polls = 0
+        self._hits = 0
+
+    def snapshot(self, address):
+        """Get the current snapshot of a device, polling it if the cached one is stale"""
+        while True:
+            with self._lock:
+                snapshot = self._snapshots.get(address)
+                if snapshot and time.time() - snapshot['polled_at'] < self.poll_interval:
+                    self._hits += 1
+                    return snapshot
+
+                done = self._refreshing.get(address)
+                if done is None:
+                    done = self._refreshing[address] = threading.Event()
+                    break
+
+            # Another request is already polling this device
+            done.wait(self.poll_interval * 5)
+            with self._lock:
+                snapshot = self._snapshots.get(address)
+                if snapshot and done.is_set():
+                    self._hits += 1
+                    return snapshot
+
+        try:
+            snapshot = self._poll(address, snapshot)
+            with self._lock:
+                self._snapshots[address] = snapshot
+                self._snapshots.move_to_end(address)
+                while len(self._snapshots) > self.max_devices:
+                    self._snapshots.popitem(last=False)
+            return snapshot
+        finally:
+            with self._lock:
+                del self._refreshing[address]
+            done.set()
+
+    def _poll(self, address, previous):
+        """Fetch every resource concurrently and merge them into a snapshot"""
+        with self._lock:
+            self._polls += 1
+
+        futures = {name: self._executor.submit(self._fetch, address, path)
+                   for name, path in RESOURCES.items()}
+        data = {}
+        errors = {}
+        for name, future in futures.items():
+            try:
+                data[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+
+        now = time.time()
+        if errors and previous and (previous['reachable'] or previous['stale']):
+            # Keep serving the last good data, marked as stale
+            return dict(previous, polled_at=now, stale=True, reachable=False, errors=errors)
+
+        body = {name: data.get(name) for name in RESOURCES}
+        etag = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+        return {
+            'device': address,
+            'data': body,
+            'etag': etag,
+            'updated_at': now if not previous or previous['etag'] != etag else previous['updated_at'],
+            'polled_at': now,
+            'stale': False,
+            'reachable': not errors,
+            'errors': errors
+        }
+
+    def _fetch(self, address, path):
+        response = self.http.get(f"http://{address}{path}")
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self):
+        """Counters showing how many reads the cache saved"""
+        with self._lock:
+            return {
+                'devices': len(self._snapshots),
+                'polls': self._polls,
+                'cache_hits': self._hits
+            }
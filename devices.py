@@ -0,0 +1,229 @@
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+# Configuration
+ADDRESS_TTL = 24 * 60 * 60  # Trust a recorded device address for a day
+PAIRING_CODE_TTL = 10 * 60   # A pairing code shown on a device is valid for 10 minutes
+PAIRING_CODE_ATTEMPTS = 5    # Wrong codes allowed before the device must show a new one
+
+# Columns added to the devices table since it was first created
+EXTRA_COLUMNS = {
+    'owner_id': 'TEXT',
+    'ip_verified_at': 'TEXT',
+    'secret_hash': 'TEXT'
+}
+
+# ESP32s found for a user are recorded under ids scoped to that user, so
+# names chosen by one browser can't collide with another user's or a Pi's
+ESP32_ID_PREFIX = 'esp32:'
+
+PAIR_DEVICE_SQL = '''
+INSERT INTO devices (device_id, owner_id) VALUES (?, ?)
+ON CONFLICT (device_id) DO UPDATE SET owner_id = excluded.owner_id
+'''
+# Only a device that has no secret yet gets one
+ISSUE_SECRET_SQL = '''
+INSERT INTO devices (device_id, secret_hash) VALUES (?, ?)
+ON CONFLICT (device_id) DO UPDATE SET secret_hash = excluded.secret_hash
+WHERE devices.secret_hash IS NULL
+'''
+UNPAIR_DEVICE_SQL = "UPDATE devices SET owner_id = NULL WHERE device_id = ?"
+DEVICE_ADDRESS_SQL = "SELECT ip_address, ip_verified_at, last_connection FROM devices WHERE device_id = ?"
+RECORD_ADDRESS_SQL = '''
+INSERT INTO devices (device_id, ip_address, ip_verified_at) VALUES (?, ?, ?)
+ON CONFLICT (device_id) DO UPDATE SET
+    ip_address = excluded.ip_address,
+    ip_verified_at = excluded.ip_verified_at
+'''
+
+
+def _hash_secret(secret):
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+
+def esp32_device_id(user_id, name):
+    """Id under which a user's ESP32 address is recorded"""
+    return f"{ESP32_ID_PREFIX}{user_id}:{name}"
+
+
+class DeviceRegistry:
+    """Which user each device is paired with, and where devices were last found
+
+    Pairings are stored in the owner_id column of the devices table and
+    mirrored in memory in both directions, so routing a capture request to a
+    user's device does not touch the database.
+
+    Each device is issued a secret the first time it connects
+    (issue_secret), and authenticates later calls with it. Pairing needs a
+    one-time code that only the authenticated device is given and displays
+    (start_pairing), so a user can only pair a device they can see.
+
+    Device addresses found by discovery are written back to the devices
+    table with the time they were verified, so later lookups can try the
+    recorded address before sweeping the network.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._owners = {}     # device id -> user id
+        self._by_owner = {}   # user id -> set of device ids
+        self._pairing_codes = {}  # device id -> {'code', 'expires', 'attempts'}
+
+        self._migrate()
+        self._load()
+
+    def _migrate(self):
+        """Add missing columns to older devices tables"""
+        columns = [row['name'] for row in self.db.query_all("PRAGMA table_info(devices)")]
+        for name, column_type in EXTRA_COLUMNS.items():
+            if name not in columns:
+                self.db.execute(f"ALTER TABLE devices ADD COLUMN {name} {column_type}")
+
+    def _load(self):
+        for row in self.db.query_all("SELECT device_id, owner_id FROM devices WHERE owner_id IS NOT NULL"):
+            self._owners[row['device_id']] = row['owner_id']
+            self._by_owner.setdefault(row['owner_id'], set()).add(row['device_id'])
+
+    def issue_secret(self, device_id):
+        """Create a device's secret if it has none yet
+
+        Returns the secret, which is only stored hashed, or None if the
+        device already has one.
+        """
+        secret = secrets.token_urlsafe(32)
+        try:
+            if self.db.execute(ISSUE_SECRET_SQL, (device_id, _hash_secret(secret))).rowcount:
+                return secret
+        except Exception as e:
+            print(f"Error issuing device secret: {e}")
+        return None
+
+    def check_secret(self, device_id, secret):
+        """Check the secret a device presented"""
+        if not isinstance(secret, str) or not secret:
+            return False
+        row = self.db.query_one("SELECT secret_hash FROM devices WHERE device_id = ?", (device_id,))
+        if not row or not row['secret_hash']:
+            return False
+        return hmac.compare_digest(row['secret_hash'], _hash_secret(secret))
+
+    def start_pairing(self, device_id):
+        """Create a pairing code for an authenticated device to display
+
+        Returns (success, code or message); a device that is already paired
+        gets no code.
+        """
+        with self._lock:
+            # Drop codes nobody used before they expired
+            now = time.time()
+            for expired in [key for key, pending in self._pairing_codes.items() if pending['expires'] < now]:
+                del self._pairing_codes[expired]
+
+            if device_id in self._owners:
+                return False, "Device is already paired"
+
+            code = f"{secrets.randbelow(10 ** 6):06d}"
+            self._pairing_codes[device_id] = {
+                'code': code,
+                'expires': now + PAIRING_CODE_TTL,
+                'attempts': 0
+            }
+            return True, code
+
+    def _check_pairing_code(self, device_id, code):
+        """Check and use up a device's pairing code. Must be called with the lock held."""
+        pending = self._pairing_codes.get(device_id)
+        if not pending or pending['expires'] < time.time():
+            self._pairing_codes.pop(device_id, None)
+            return False, "No pairing code is active for this device"
+
+        if not hmac.compare_digest(pending['code'], str(code or '')):
+            pending['attempts'] += 1
+            if pending['attempts'] >= PAIRING_CODE_ATTEMPTS:
+                del self._pairing_codes[device_id]
+            return False, "Wrong pairing code"
+
+        del self._pairing_codes[device_id]
+        return True, None
+
+    def pair(self, device_id, user_id, code):
+        """Pair a device with a user, given the code the device displays"""
+        with self._lock:
+            owner = self._owners.get(device_id)
+            if owner == user_id:
+                return True, "Device already paired"
+            if owner:
+                return False, "Device is paired with another account"
+
+            valid, message = self._check_pairing_code(device_id, code)
+            if not valid:
+                return False, message
+
+            try:
+                self.db.execute(PAIR_DEVICE_SQL, (device_id, user_id))
+            except Exception as e:
+                print(f"Error pairing device: {e}")
+                return False, "Failed to save pairing"
+
+            self._owners[device_id] = user_id
+            self._by_owner.setdefault(user_id, set()).add(device_id)
+            return True, "Device paired"
+
+    def unpair(self, device_id, user_id):
+        """Remove a user's pairing with a device"""
+        with self._lock:
+            if self._owners.get(device_id) != user_id:
+                return False, "Device is not paired with your account"
+
+            try:
+                self.db.execute(UNPAIR_DEVICE_SQL, (device_id,))
+            except Exception as e:
+                print(f"Error unpairing device: {e}")
+                return False, "Failed to save pairing"
+
+            del self._owners[device_id]
+            devices = self._by_owner.get(user_id)
+            devices.discard(device_id)
+            if not devices:
+                del self._by_owner[user_id]
+            return True, "Device unpaired"
+
+    def owner_of(self, device_id):
+        """Get the id of the user a device is paired with"""
+        with self._lock:
+            return self._owners.get(device_id)
+
+    def cached_address(self, device_id, max_age=ADDRESS_TTL):
+        """Get the recorded address of a device, if it was seen recently enough"""
+        row = self.db.query_one(DEVICE_ADDRESS_SQL, (device_id,))
+        if not row or not row['ip_address']:
+            return None
+
+        # Either discovery verified it or the device reported it itself
+        seen = []
+        for value in (row['ip_verified_at'], row['last_connection']):
+            try:
+                seen.append(datetime.fromisoformat(value))
+            except (TypeError, ValueError):
+                continue
+
+        if not seen or datetime.now() - max(seen) > timedelta(seconds=max_age):
+            return None
+        return row['ip_address']
+
+    def record_address(self, device_id, ip_address):
+        """Remember where a device was found"""
+        try:
+            self.db.execute(RECORD_ADDRESS_SQL, (device_id, ip_address, datetime.now().isoformat()))
+        except Exception as e:
+            print(f"Error recording device address: {e}")
+
+    def devices_for(self, user_id):
+        """Get the ids of the devices paired with a user"""
+        with self._lock:
+            return sorted(self._by_owner.get(user_id, ()))
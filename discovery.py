@@ -0,0 +1,130 @@
+import socket
+import struct
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# fcntl is only available on Unix; elsewhere a /24 netmask is assumed
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Configuration
+MAX_IN_FLIGHT = 64         # Probes running at the same time
+PROBE_CONNECT_TIMEOUT = 0.3
+PROBE_READ_TIMEOUT = 0.5
+MAX_SCAN_PREFIX = 22       # Never sweep more than a /22 (about 1000 hosts)
+DEFAULT_NETMASK = "255.255.255.0"
+
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+
+def get_active_interface():
+    """Get the address and netmask of the interface used for outbound traffic"""
+    try:
+        # Connecting a UDP socket sends nothing but picks the outbound interface
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            ip_address = s.getsockname()[0]
+    except OSError:
+        try:
+            ip_address = socket.gethostbyname(socket.gethostname())
+        except OSError as e:
+            print(f"Error getting network interface: {e}")
+            return None
+
+    name, netmask = _find_netmask(ip_address)
+    return {
+        "name": name or socket.gethostname(),
+        "addr": ip_address,
+        "netmask": netmask or DEFAULT_NETMASK
+    }
+
+
+def _find_netmask(ip_address):
+    """Find the interface holding ip_address and its netmask (Linux only)"""
+    if fcntl is None:
+        return None, None
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            request = struct.pack('256s', name[:15].encode('utf-8'))
+            try:
+                addr = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+                if addr != ip_address:
+                    continue
+                netmask = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, request)[20:24])
+                return name, netmask
+            except OSError:
+                continue  # Interface without an IPv4 address
+    return None, None
+
+
+def local_address(value):
+    """Normalize value if it is an IPv4 address on a local network, else None"""
+    try:
+        ip = ipaddress.IPv4Address(str(value).strip())
+    except ValueError:
+        return None
+    # Link-local is excluded too: it holds cloud metadata services (169.254.169.254)
+    if not ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_unspecified:
+        return None
+    return str(ip)
+
+
+def scan_network(ip_address, netmask):
+    """List the host addresses to probe on the interface's network
+
+    Networks larger than MAX_SCAN_PREFIX are narrowed to the block of that
+    size around our own address.
+    """
+    network = ipaddress.ip_network(f"{ip_address}/{netmask}", strict=False)
+    if network.prefixlen < MAX_SCAN_PREFIX:
+        network = ipaddress.ip_network(f"{ip_address}/{MAX_SCAN_PREFIX}", strict=False)
+    return [str(host) for host in network.hosts() if str(host) != ip_address]
+
+
+class DeviceDiscovery:
+    """Finds ESP32 devices by probing their /health endpoint concurrently
+
+    Every address on the local network is probed over HTTP directly (no ping
+    subprocesses), with at most max_in_flight probes at a time and short
+    timeouts, and the sweep stops as soon as one device answers.
+    """
+
+    def __init__(self, http_client, max_in_flight=MAX_IN_FLIGHT,
+                 connect_timeout=PROBE_CONNECT_TIMEOUT, read_timeout=PROBE_READ_TIMEOUT):
+        self.http = http_client
+        self.max_in_flight = max_in_flight
+        self.timeout = (connect_timeout, read_timeout)
+
+    def probe(self, ip):
+        """Whether a device at ip answers /health"""
+        try:
+            response = self.http.get(f"http://{ip}/health", timeout=self.timeout)
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def find_device(self, interface=None):
+        """Sweep the local network and return the first address that answers, or None"""
+        interface = interface or get_active_interface()
+        if not interface or not interface['addr'] or not interface['netmask']:
+            raise ValueError("Could not determine network details")
+
+        candidates = scan_network(interface['addr'], interface['netmask'])
+        return self.find_first(candidates)
+
+    def find_first(self, candidates):
+        """Probe candidates concurrently and return the first that answers, or None"""
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='discovery')
+        try:
+            futures = {executor.submit(self.probe, ip): ip for ip in candidates}
+            for future in as_completed(futures):
+                if future.result():
+                    return futures[future]
+            return None
+        finally:
+            # Don't wait for the probes still running once we have an answer
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,72 @@
+import json
+import queue
+import threading
+
+# Configuration
+MAX_QUEUED_EVENTS = 100   # Events buffered per subscriber before dropping
+KEEPALIVE_SECONDS = 15    # Send a comment line this often to keep proxies from closing the stream
+RETRY_MILLISECONDS = 3000 # How long the browser waits before reconnecting
+
+
+def format_event(event, data):
+    """Format an event as a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventBroker:
+    """Per-user publish/subscribe of progress events
+
+    Each open event stream gets its own bounded queue. Publishing never
+    blocks: if a subscriber has fallen too far behind, new events for it are
+    dropped rather than holding up the request that published them.
+    """
+
+    def __init__(self, max_queued=MAX_QUEUED_EVENTS):
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user id -> set of queues
+
+    def subscribe(self, user_id):
+        """Register a new subscriber queue for a user"""
+        q = queue.Queue(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        """Remove a subscriber queue"""
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, event, data):
+        """Send an event to every open stream of a user"""
+        if not user_id:
+            return
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                pass  # Slow consumer, drop the event
+
+    def stream(self, user_id, keepalive=KEEPALIVE_SECONDS):
+        """Generator yielding Server-Sent Events for a user until disconnect"""
+        q = self.subscribe(user_id)
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                try:
+                    event, data = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            self.unsubscribe(user_id, q)
@@ -0,0 +1,121 @@
+import io
+import os
+import json
+import uuid
+import threading
+
+# Configuration
+CHUNK_SIZE = 64 * 1024  # Bytes read from the image file per chunk
+
+
+class MultipartFileStream:
+    """multipart/form-data body for a single file field, streamed in chunks
+
+    requests sends an iterable with a length as a regular Content-Length
+    request, reading the file chunk by chunk instead of building the whole
+    body in memory. Iterating again starts over from the beginning of the
+    file, so the body can be re-sent when a connection is retried.
+    """
+
+    def __init__(self, field, filename, fileobj, content_type='image/jpeg', chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._fileobj = fileobj
+
+        self._head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+        # Measure the file without reading it
+        self._start = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        self._size = fileobj.tell() - self._start
+        fileobj.seek(self._start)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        self._fileobj.seek(self._start)
+        yield self._head
+        while True:
+            chunk = self._fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+
+class GeminiClient:
+    """Client for the Gemini proxy's /analyze-image endpoint
+
+    Every analysis goes through analyze(), which streams the image to the
+    proxy as the multipart 'image' field the proxy expects. At most
+    max_concurrency calls are in flight at once.
+
+    If a preprocessor is given, images are passed through it first and the
+    returned box_2d coordinates are mapped back to the original image.
+    """
+
+    def __init__(self, url, http_client, max_concurrency, preprocessor=None):
+        self.url = url
+        self.http = http_client
+        self.preprocessor = preprocessor
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def analyze(self, image, filename='image.jpg'):
+        """Analyze an image given as a file path, bytes, or an open binary file
+
+        Returns the proxy's "response" data, raises ValueError on failure.
+        """
+        if isinstance(image, (bytes, bytearray)):
+            return self._analyze_file(io.BytesIO(image), filename)
+        if isinstance(image, str):
+            with open(image, 'rb') as fileobj:
+                return self._analyze_file(fileobj, filename)
+        return self._analyze_file(image, filename)
+
+    def _analyze_file(self, fileobj, filename):
+        factor = 1.0
+        if self.preprocessor:
+            fileobj, factor = self.preprocessor.process(fileobj)
+
+        body = MultipartFileStream('image', filename, fileobj)
+
+        print(f"🔸 Sending image to Gemini proxy")
+        with self._slots:
+            response = self.http.post(self.url, data=body,
+                                      headers={'Content-Type': body.content_type})
+
+        print("🔨 Proxy status code:", response.status_code)
+        print("🔨 Proxy raw response:", response.text)
+
+        if response.status_code != 200:
+            raise ValueError("Failed to analyze image")
+
+        try:
+            response_data = response.json()
+        except ValueError:
+            raise ValueError("Invalid JSON response from Gemini proxy")
+
+        if "response" not in response_data:
+            raise ValueError("Failed to get proper analysis data from server")
+
+        # Extract the predictions and recommendations
+        gemini_data = response_data["response"]
+        if isinstance(gemini_data, str):
+            try:
+                gemini_data = json.loads(gemini_data)
+            except ValueError:
+                raise ValueError("Invalid analysis data from Gemini proxy")
+
+        if self.preprocessor:
+            gemini_data = self.preprocessor.map_predictions(gemini_data, factor)
+        return gemini_data
@@ -0,0 +1,159 @@
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# Configuration
+FLUSH_INTERVAL_MS = 500           # Write buffered heartbeats at least this often
+MAX_BATCH_SIZE = 200              # ...or as soon as this many are buffered
+MAX_BUFFERED = 10000              # Drop the oldest heartbeats beyond this if the database is down
+RAW_RETENTION_HOURS = 24 * 7      # Keep individual heartbeats for a week
+COMPACTION_INTERVAL = 60 * 60     # Downsample old heartbeats once an hour
+
+INSERT_HEARTBEAT_SQL = "INSERT OR IGNORE INTO heartbeats (device_id, timestamp, status) VALUES (?, ?, ?)"
+
+# Fold raw heartbeats older than the cutoff into per-device hourly rows.
+# SQLite takes the bare status column from the row that supplied max(timestamp).
+COMPACT_HEARTBEATS_SQL = '''
+INSERT INTO heartbeats_hourly (device_id, hour, count, first_seen, last_seen, last_status)
+SELECT device_id, substr(timestamp, 1, 13), count(*), min(timestamp), max(timestamp), status
+FROM heartbeats
+WHERE timestamp < ?
+GROUP BY device_id, substr(timestamp, 1, 13)
+ON CONFLICT (device_id, hour) DO UPDATE SET
+    count = count + excluded.count,
+    first_seen = min(first_seen, excluded.first_seen),
+    last_seen = max(last_seen, excluded.last_seen),
+    last_status = CASE WHEN excluded.last_seen >= last_seen
+                       THEN excluded.last_status ELSE last_status END
+'''
+DELETE_COMPACTED_SQL = "DELETE FROM heartbeats WHERE timestamp < ?"
+
+
+class HeartbeatWriter:
+    """Buffers heartbeats in memory and writes them in batches
+
+    /heartbeat only appends to the buffer, so it can answer immediately. A
+    background thread writes the buffer in a single transaction every
+    flush_interval_ms, or sooner once max_batch heartbeats are waiting. The
+    same thread periodically compacts heartbeats older than the retention
+    window into per-device hourly summaries in heartbeats_hourly.
+
+    If a batch cannot be written it is retried one heartbeat at a time:
+    heartbeats that fail because the database is unavailable go back in the
+    buffer, heartbeats that fail for any other reason are dropped.
+    """
+
+    def __init__(self, db, flush_interval_ms=FLUSH_INTERVAL_MS, max_batch=MAX_BATCH_SIZE,
+                 raw_retention_hours=RAW_RETENTION_HOURS, compaction_interval=COMPACTION_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.raw_retention = timedelta(hours=raw_retention_hours)
+        self.compaction_interval = compaction_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._buffer = []
+        self._running = True
+        self._last_compaction = 0
+
+        self._create_tables()
+
+        self._thread = threading.Thread(target=self._run, name='heartbeat-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _create_tables(self):
+        with self.db.transaction() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS heartbeats_hourly (
+                device_id TEXT,
+                hour TEXT,
+                count INTEGER,
+                first_seen TEXT,
+                last_seen TEXT,
+                last_status TEXT,
+                PRIMARY KEY (device_id, hour)
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_heartbeats_timestamp ON heartbeats (timestamp)")
+
+    def add(self, device_id, timestamp, status):
+        """Queue a heartbeat for the next batch"""
+        with self._lock:
+            self._buffer.append((device_id, timestamp, status))
+            if len(self._buffer) > MAX_BUFFERED:
+                del self._buffer[:len(self._buffer) - MAX_BUFFERED]
+            if len(self._buffer) >= self.max_batch:
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write everything buffered so far in one transaction"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+
+        if not batch:
+            return 0
+
+        try:
+            self.db.executemany(INSERT_HEARTBEAT_SQL, batch)
+            return len(batch)
+        except Exception as e:
+            print(f"Error writing heartbeats: {e}")
+
+        # Write the heartbeats one at a time, so one bad row can't hold up the rest
+        written = 0
+        retry = []
+        for row in batch:
+            try:
+                self.db.execute(INSERT_HEARTBEAT_SQL, row)
+                written += 1
+            except sqlite3.OperationalError:
+                retry.append(row)
+            except Exception as e:
+                print(f"Dropping a heartbeat that could not be written: {e}")
+
+        # Put what failed on a database error back in front of anything that arrived meanwhile
+        with self._lock:
+            self._buffer[:0] = retry
+            if len(self._buffer) > MAX_BUFFERED:
+                del self._buffer[:len(self._buffer) - MAX_BUFFERED]
+        return written
+
+    def compact(self):
+        """Downsample heartbeats older than the retention window to hourly summaries"""
+        cutoff = (datetime.now() - self.raw_retention).isoformat()
+        try:
+            with self.db.transaction() as conn:
+                conn.execute(COMPACT_HEARTBEATS_SQL, (cutoff,))
+                deleted = conn.execute(DELETE_COMPACTED_SQL, (cutoff,)).rowcount
+            if deleted:
+                print(f"Compacted {deleted} heartbeats older than {cutoff}")
+        except Exception as e:
+            print(f"Error compacting heartbeats: {e}")
+
+    def stop(self):
+        """Stop the background thread and write what is left"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._buffer) < self.max_batch:
+                    self._wakeup.wait(self.flush_interval)
+                running = self._running
+
+            if not running:
+                break
+
+            self.flush()
+
+            if time.time() - self._last_compaction >= self.compaction_interval:
+                self._last_compaction = time.time()
+                self.compact()
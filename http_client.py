@@ -0,0 +1,81 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration
+CONNECT_TIMEOUT = 3.05   # Seconds to establish a connection
+READ_TIMEOUT = 30        # Seconds to wait for a response
+POOL_CONNECTIONS = 10    # Number of hosts to keep connection pools for
+POOL_MAXSIZE = 10        # Keep-alive connections kept per host
+RETRIES = 2              # Retries on connection errors and retryable statuses
+BACKOFF_FACTOR = 0.5     # Sleep between retries: 0.5s, 1s, 2s, ...
+# Not 502: the Gemini proxy answers 502 when the model returned nothing,
+# and retrying would resend (and pay for) the whole generation request
+RETRY_STATUSES = (503, 504)
+
+
+class HttpClient:
+    """Shared HTTP client with keep-alive connection pooling
+
+    Wraps a single requests.Session so connections (and TLS sessions) are
+    reused between calls instead of paying a new handshake every time. Every
+    call gets explicit connect/read timeouts unless the caller passes its own,
+    and failed connections or unavailable/timed out gateways are retried with
+    backoff.
+
+    host_pool_sizes maps URL prefixes (e.g. "https://proxy.example.com/") to
+    the number of connections to keep for that host.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 retries=RETRIES, backoff_factor=BACKOFF_FACTOR, host_pool_sizes=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_connections = pool_connections
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter(pool_maxsize))
+        self._session.mount('https://', self._adapter(pool_maxsize))
+
+        for prefix, maxsize in (host_pool_sizes or {}).items():
+            self.mount_host(prefix, maxsize)
+
+    def mount_host(self, prefix, pool_maxsize):
+        """Use a dedicated pool size for URLs starting with prefix"""
+        with self._lock:
+            self._session.mount(prefix, self._adapter(pool_maxsize))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the shared session"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+    def _adapter(self, pool_maxsize):
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,  # Never resend a request the server may already be processing
+            status=self.retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # The proxy calls are POSTs, retry them too
+            backoff_factor=self.backoff_factor,
+            raise_on_status=False
+        )
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry
+        )
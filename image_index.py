@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+
+# Configuration
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+RESULT_EXTENSION = '.json'
+
+SAVE_RECORD = """INSERT OR REPLACE INTO images
+    (filename, owner, request_id, size, uploaded_at, result_path, result_at)
+    VALUES (:filename, :owner, :request_id, :size, :uploaded_at, :result_path, :result_at)"""
+
+
+class ImageIndex:
+    """Index of uploaded images and their analysis results
+
+    Every upload and result write is recorded here, in memory and in the
+    images table, so finding the latest image or result is a lookup instead
+    of listing and stat-ing the whole upload folder. The index is rebuilt
+    from SQLite at startup and reconciled with what is actually on disk.
+    """
+
+    def __init__(self, upload_folder, db):
+        self.upload_folder = upload_folder
+        self.db = db
+
+        self._lock = threading.Lock()
+        self._images = {}           # filename -> record dict
+        self._latest_image = None   # filename of the newest upload
+        self._latest_result = None  # filename of the newest result
+        self._by_request_id = {}    # capture request id -> filename
+
+        self._create_table()
+        self.rebuild()
+
+    def _create_table(self):
+        self.db.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            filename TEXT PRIMARY KEY,
+            owner TEXT,
+            request_id TEXT,
+            size INTEGER,
+            uploaded_at REAL,
+            result_path TEXT,
+            result_at REAL
+        )
+        ''')
+
+    def rebuild(self):
+        """Load the index from SQLite and reconcile it with the upload folder"""
+        with self._lock:
+            self._images = {
+                row['filename']: dict(row)
+                for row in self.db.query_all("SELECT * FROM images")
+            }
+
+            # One pass over the folder to pick up files written while the
+            # server was down and drop rows whose files are gone
+            on_disk = {}
+            for entry in os.scandir(self.upload_folder):
+                if entry.is_file():
+                    on_disk[entry.name] = entry.stat()
+
+            for filename, record in list(self._images.items()):
+                result_path = record.get('result_path')
+                if result_path and os.path.basename(result_path) not in on_disk:
+                    record['result_path'] = None
+                    record['result_at'] = None
+                if filename not in on_disk:
+                    if not record.get('result_path'):
+                        del self._images[filename]
+                        continue
+                    record['size'] = None
+                    record['uploaded_at'] = None
+
+            for name, stat in on_disk.items():
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    record = self._images.setdefault(name, self._new_record(name))
+                    if record['uploaded_at'] is None:
+                        record['size'] = stat.st_size
+                        record['uploaded_at'] = stat.st_mtime
+                elif name.endswith(RESULT_EXTENSION):
+                    image_name = name[:-len(RESULT_EXTENSION)]
+                    record = self._images.setdefault(image_name, self._new_record(image_name))
+                    if not record.get('result_path'):
+                        record['result_path'] = os.path.join(self.upload_folder, name)
+                        record['result_at'] = stat.st_mtime
+
+            with self.db.transaction() as conn:
+                conn.execute("DELETE FROM images")
+                conn.executemany(SAVE_RECORD, list(self._images.values()))
+
+            self._latest_image = self._find_latest('uploaded_at')
+            self._latest_result = self._find_latest('result_at')
+            self._by_request_id = {
+                r['request_id']: r['filename']
+                for r in self._images.values() if r.get('request_id')
+            }
+
+    def record_upload(self, filename, owner=None, request_id=None):
+        """Record an image that was just saved to the upload folder"""
+        file_path = os.path.join(self.upload_folder, filename)
+        size = os.path.getsize(file_path)
+        uploaded_at = time.time()
+
+        with self._lock:
+            record = self._images.setdefault(filename, self._new_record(filename))
+            record.update({
+                'owner': owner or record.get('owner'),
+                'request_id': request_id or record.get('request_id'),
+                'size': size,
+                'uploaded_at': uploaded_at
+            })
+            self._latest_image = filename
+            if record['request_id']:
+                self._by_request_id[record['request_id']] = filename
+            self._save(record)
+            return dict(record)
+
+    def record_result(self, filename, result_path):
+        """Record the analysis result file written for an image"""
+        with self._lock:
+            record = self._images.setdefault(filename, self._new_record(filename))
+            record['result_path'] = result_path
+            record['result_at'] = time.time()
+            self._latest_result = filename
+            self._save(record)
+            return dict(record)
+
+    def get(self, filename):
+        """Get a copy of the record for an image"""
+        with self._lock:
+            record = self._images.get(filename)
+            return dict(record) if record else None
+
+    def find_by_request_id(self, request_id):
+        """Get the record of the image uploaded for a capture request"""
+        with self._lock:
+            record = self._images.get(self._by_request_id.get(request_id))
+            return dict(record) if record else None
+
+    def latest_image(self):
+        """Get the record of the most recently uploaded image"""
+        return self.get(self._latest_image) if self._latest_image else None
+
+    def latest_result(self):
+        """Get the record of the image with the most recent analysis result"""
+        return self.get(self._latest_result) if self._latest_result else None
+
+    def _new_record(self, filename):
+        return {
+            'filename': filename,
+            'owner': None,
+            'request_id': None,
+            'size': None,
+            'uploaded_at': None,
+            'result_path': None,
+            'result_at': None
+        }
+
+    def _find_latest(self, field):
+        """Find the filename with the largest value of field (used on rebuild only)"""
+        candidates = [r for r in self._images.values() if r.get(field) is not None]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda r: r[field])['filename']
+
+    def _save(self, record):
+        """Write a record to SQLite. Must be called with the lock held."""
+        try:
+            self.db.execute(SAVE_RECORD, record)
+        except Exception as e:
+            print(f"Error saving image index record: {e}")
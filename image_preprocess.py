@@ -0,0 +1,96 @@
+import io
+import numbers
+
+# Pillow is optional: without it images are sent to Gemini unchanged
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Configuration
+MAX_DIMENSION = 1024  # Longest side of the image sent to Gemini, in pixels
+JPEG_QUALITY = 85
+STRIP_EXIF = True
+
+
+class ImagePreprocessor:
+    """Downscale and re-encode images before they are sent to Gemini
+
+    The model does not need full-resolution Pi captures, so images are
+    shrunk to max_dimension on their longest side and re-encoded as JPEG
+    (without EXIF metadata by default). The aspect ratio is preserved, so a
+    single factor maps box_2d coordinates returned for the smaller image back
+    onto the original, whichever axis order the coordinates use.
+    """
+
+    def __init__(self, max_dimension=MAX_DIMENSION, jpeg_quality=JPEG_QUALITY, strip_exif=STRIP_EXIF):
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.strip_exif = strip_exif
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def signature(self):
+        """Short description of the settings, for use in cache keys"""
+        if not self.enabled:
+            return "original"
+        exif = "noexif" if self.strip_exif else "exif"
+        return f"max{self.max_dimension}-q{self.jpeg_quality}-{exif}"
+
+    def process(self, fileobj):
+        """Preprocess an open binary image file
+
+        Returns (fileobj, factor): the file to send, positioned at its start,
+        and the factor that maps coordinates in it back to the original
+        image. On any error the original file is returned with factor 1.0.
+        """
+        start = fileobj.tell()
+        if not self.enabled:
+            return fileobj, 1.0
+
+        try:
+            img = Image.open(fileobj)
+            width, height = img.size
+            exif = img.info.get('exif')
+
+            longest = max(width, height)
+            if longest > self.max_dimension:
+                scale = self.max_dimension / longest
+                img = img.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                 Image.LANCZOS)
+            elif img.format == 'JPEG' and not (self.strip_exif and exif):
+                # Already small enough and nothing to strip, send as is
+                fileobj.seek(start)
+                return fileobj, 1.0
+
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            save_args = {'quality': self.jpeg_quality, 'optimize': True}
+            if exif and not self.strip_exif:
+                save_args['exif'] = exif
+
+            processed = io.BytesIO()
+            img.save(processed, 'JPEG', **save_args)
+            processed.seek(0)
+
+            return processed, longest / max(img.size)
+        except Exception as e:
+            print(f"Error preprocessing image, sending original: {e}")
+            fileobj.seek(start)
+            return fileobj, 1.0
+
+    def map_predictions(self, gemini_data, factor):
+        """Scale box_2d coordinates of predictions back to the original image"""
+        if factor == 1.0 or not isinstance(gemini_data, dict):
+            return gemini_data
+
+        for pred in gemini_data.get("predictions", []):
+            box = pred.get("box_2d")
+            if isinstance(box, list) and len(box) == 4 and \
+                    all(isinstance(v, numbers.Number) for v in box):
+                pred["box_2d"] = [round(v * factor) for v in box]
+
+        return gemini_data
@@ -0,0 +1,115 @@
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Configuration
+MAX_WORKERS = 4          # Jobs running at the same time
+MAX_QUEUED_JOBS = 50     # Jobs waiting for a worker before new ones are rejected
+MAX_FINISHED_JOBS = 200  # Finished jobs kept around for status lookups
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class JobManager:
+    """Runs slow work (such as Gemini analyses) on a bounded worker pool
+
+    Submitting returns a job record immediately; callers look the job up by
+    id later to get its state and result. At most max_workers jobs run at
+    once and at most max_queued wait behind them, anything beyond that is
+    rejected with JobQueueFull instead of piling up in memory.
+
+    listener, if given, is called with a copy of the job every time its
+    state changes.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queued=MAX_QUEUED_JOBS,
+                 max_finished=MAX_FINISHED_JOBS, listener=None):
+        self.max_finished = max_finished
+        self.listener = listener
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job id -> job dict, oldest first
+
+    def submit(self, kind, func, *args, user_id=None, **kwargs):
+        """Queue func(*args, **kwargs) and return a copy of the job record
+
+        The function's return value becomes the job result; an exception
+        marks the job as failed with the exception message as its error.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull("Too many jobs queued, try again later")
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user_id,
+            "state": "queued",
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+
+        with self._lock:
+            self._jobs[job["id"]] = job
+            snapshot = dict(job)
+
+        try:
+            self._executor.submit(self._run, job["id"], func, args, kwargs)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._jobs.pop(job["id"], None)
+            raise
+
+        return snapshot
+
+    def get(self, job_id):
+        """Get a copy of a job by id"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, func, args, kwargs):
+        """Run a job on a worker thread and record the outcome"""
+        self._update(job_id, state="running", started_at=datetime.now().isoformat())
+        try:
+            result = func(*args, **kwargs)
+            self._update(job_id, state="done", result=result,
+                         finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, state="failed", error=str(e),
+                         finished_at=datetime.now().isoformat())
+        finally:
+            self._slots.release()
+            self._evict()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            snapshot = dict(job)
+
+        if self.listener:
+            try:
+                self.listener(snapshot)
+            except Exception as e:
+                print(f"Error notifying job listener: {e}")
+
+    def _evict(self):
+        """Drop the oldest finished jobs once there are too many"""
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items()
+                        if job["state"] in ("done", "failed")]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
@@ -0,0 +1,149 @@
+import time
+import atexit
+import threading
+from datetime import datetime
+
+# Configuration
+# How recent the last contact must be for a device to count as connected,
+# per kind of contact. Heartbeats arrive every 2 minutes from the Pi.
+CONNECTED_WINDOWS = {
+    'heartbeat': 180,
+    'connected': 300,
+    'upload': 300,
+    'capture': 300
+}
+DEFAULT_WINDOW = 300
+PERSIST_INTERVAL = 30  # Write last-seen times to the devices table at most this often
+
+UPSERT_LAST_SEEN_SQL = '''
+INSERT INTO devices (device_id, last_seen) VALUES (?, ?)
+ON CONFLICT (device_id) DO UPDATE SET last_seen = excluded.last_seen
+'''
+
+
+def _parse_time(value):
+    """Parse an ISO timestamp into epoch seconds, or None"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class PresenceTracker:
+    """In-memory last-seen table for devices
+
+    /heartbeat, /device-connected, /upload and /mark-complete record contact
+    here, so checking whether a device is online is a dictionary lookup
+    rather than a scan of requests, files and heartbeats. Last-seen times are
+    written back to the devices table at most every PERSIST_INTERVAL seconds
+    and loaded from it (and the heartbeats table) at startup.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._devices = {}  # device id -> presence dict
+        self._dirty = set()
+        self._last_persist = time.time()
+
+        self._migrate()
+        self._load()
+        atexit.register(self.persist)
+
+    def _migrate(self):
+        """Add the last_seen column to older devices tables"""
+        columns = [row['name'] for row in self.db.query_all("PRAGMA table_info(devices)")]
+        if 'last_seen' not in columns:
+            self.db.execute("ALTER TABLE devices ADD COLUMN last_seen TEXT")
+
+    def _load(self):
+        """Seed the table from the devices table and the latest heartbeat per device"""
+        rows = self.db.query_all("SELECT device_id, ip_address, last_connection, last_seen FROM devices")
+        for row in rows:
+            seen = max(filter(None, [_parse_time(row['last_seen']),
+                                     _parse_time(row['last_connection'])]), default=None)
+            if seen:
+                self._devices[row['device_id']] = {
+                    'last_seen': seen,
+                    'source': 'connected',
+                    'ip_address': row['ip_address'],
+                    'status': None
+                }
+
+        # The (device_id, timestamp) primary key makes this a per-device index lookup
+        rows = self.db.query_all("SELECT device_id, max(timestamp) AS timestamp, status "
+                                 "FROM heartbeats GROUP BY device_id")
+        for row in rows:
+            seen = _parse_time(row['timestamp'])
+            device = self._devices.get(row['device_id'])
+            if seen and (not device or seen > device['last_seen']):
+                self._devices[row['device_id']] = {
+                    'last_seen': seen,
+                    'source': 'heartbeat',
+                    'ip_address': device['ip_address'] if device else None,
+                    'status': row['status']
+                }
+
+    def touch(self, device_id, source, status=None, ip_address=None):
+        """Record contact from a device"""
+        if not device_id:
+            return
+
+        now = time.time()
+        with self._lock:
+            device = self._devices.setdefault(device_id, {
+                'last_seen': now, 'source': source, 'ip_address': None, 'status': None
+            })
+            device['last_seen'] = now
+            device['source'] = source
+            if status is not None:
+                device['status'] = status
+            if ip_address:
+                device['ip_address'] = ip_address
+            self._dirty.add(device_id)
+
+            persist = now - self._last_persist >= PERSIST_INTERVAL
+            if persist:
+                self._last_persist = now
+
+        if persist:
+            self.persist()
+
+    def persist(self):
+        """Write changed last-seen times to the devices table"""
+        with self._lock:
+            rows = [(device_id, datetime.fromtimestamp(self._devices[device_id]['last_seen']).isoformat())
+                    for device_id in self._dirty]
+            self._dirty.clear()
+
+        if not rows:
+            return
+        try:
+            self.db.executemany(UPSERT_LAST_SEEN_SQL, rows)
+        except Exception as e:
+            print(f"Error saving device presence: {e}")
+
+    def is_connected(self, device_id=None):
+        """Whether a device (or, without device_id, any device) is online"""
+        if device_id is not None:
+            with self._lock:
+                device = self._devices.get(device_id)
+                return bool(device) and self._is_fresh(device, time.time())
+        return any(d['connected'] for d in self.devices())
+
+    def devices(self):
+        """Presence of every known device"""
+        now = time.time()
+        with self._lock:
+            return [{
+                'device_id': device_id,
+                'connected': self._is_fresh(device, now),
+                'last_seen': datetime.fromtimestamp(device['last_seen']).isoformat(),
+                'source': device['source'],
+                'status': device['status'],
+                'ip_address': device['ip_address']
+            } for device_id, device in self._devices.items()]
+
+    def _is_fresh(self, device, now):
+        window = CONNECTED_WINDOWS.get(device['source'], DEFAULT_WINDOW)
+        return now - device['last_seen'] < window
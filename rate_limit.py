@@ -0,0 +1,123 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# Configuration
+MAX_KEYS = 10000          # Buckets kept in memory; the least recently used are dropped
+PRUNE_EVERY = 1000        # Delete full buckets from the shared table every this many checks
+
+# Take tokens from a bucket in one statement, so concurrent workers can't
+# both spend the last token. Nothing changes if there are too few tokens.
+TAKE_TOKENS_SQL = '''
+INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (:key, :burst - :cost, :now)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = min(:burst, tokens + (:now - updated) * :rate) - :cost,
+    updated = :now
+WHERE min(:burst, tokens + (:now - updated) * :rate) >= :cost
+'''
+BUCKET_TOKENS_SQL = "SELECT min(:burst, tokens + (:now - updated) * :rate) AS tokens FROM rate_limit_buckets WHERE key = :key"
+PRUNE_BUCKETS_SQL = "DELETE FROM rate_limit_buckets WHERE key > ? AND key < ? AND updated < ?"
+
+
+class TokenBucketLimiter:
+    """Token bucket rate limiter keyed by any string (client IP, account, ...)
+
+    Each key gets a bucket of `burst` tokens that refills at `rate` tokens
+    per second; a request is allowed if it can take a token. Buckets live in
+    memory, or with db set, in the rate_limit_buckets table so every worker
+    process shares the same limits.
+    """
+
+    def __init__(self, name, rate, burst, db=None, max_keys=MAX_KEYS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.db = db
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated), most recent last
+        self._allowed = 0
+        self._limited = 0
+        self._checks = 0
+
+        if db is not None:
+            db.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL,
+                updated REAL
+            )
+            ''')
+
+    def allow(self, key, cost=1):
+        """Try to take tokens for key
+
+        Returns (allowed, retry_after) where retry_after is the number of
+        seconds until the request would be allowed.
+        """
+        key = f"{self.name}:{key}"
+        now = time.time()
+        if self.db is not None:
+            allowed, tokens = self._take_shared(key, cost, now)
+        else:
+            allowed, tokens = self._take_local(key, cost, now)
+
+        with self._lock:
+            self._checks += 1
+            if allowed:
+                self._allowed += 1
+            else:
+                self._limited += 1
+            prune = self.db is not None and self._checks % PRUNE_EVERY == 0
+
+        if prune:
+            self._prune(now)
+
+        if allowed:
+            return True, 0
+        return False, math.ceil((cost - tokens) / self.rate)
+
+    def _take_local(self, key, cost, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+    def _take_shared(self, key, cost, now):
+        params = {'key': key, 'burst': self.burst, 'rate': self.rate, 'cost': cost, 'now': now}
+        try:
+            if self.db.execute(TAKE_TOKENS_SQL, params).rowcount:
+                return True, 0
+            row = self.db.query_one(BUCKET_TOKENS_SQL, params)
+            return False, row['tokens'] if row else 0
+        except Exception as e:
+            # Fail open: a database problem should not lock everyone out
+            print(f"Error checking rate limit: {e}")
+            return True, 0
+
+    def _prune(self, now):
+        """Delete buckets that have refilled completely"""
+        try:
+            # Only this limiter's keys, which all start with "name:"
+            self.db.execute(PRUNE_BUCKETS_SQL, (f"{self.name}:", f"{self.name};", now - self.burst / self.rate))
+        except Exception as e:
+            print(f"Error pruning rate limits: {e}")
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'shared': self.db is not None,
+                'allowed': self._allowed,
+                'limited': self._limited,
+                'tracked_keys': len(self._buckets) if self.db is None else None
+            }
@@ -0,0 +1,228 @@
+import time
+import uuid
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from brushing_store import POSITIONS, position_index
+
+# Configuration
+FLUSH_INTERVAL_MS = 1000          # Write buffered samples at least this often
+MAX_BATCH_SIZE = 500              # ...or as soon as this many are buffered
+MAX_BUFFERED = 50000              # Drop the oldest samples beyond this if the database is down
+SESSION_GAP = 10 * 60             # Samples further apart than this start a new session
+MAX_TRACKED_DEVICES = 10000       # Devices whose current session is remembered
+MAX_ID_LENGTH = 64                # Longest deviceId or sessionId accepted
+
+
+def _parse_timestamp(value):
+    """Parse an ISO timestamp (as sent by the browser) into epoch seconds, or None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _check_id(sample, key):
+    """Get an optional id from a sample, raising ValueError unless it is a short string"""
+    value = sample.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, str) or len(value) > MAX_ID_LENGTH:
+        raise ValueError(f"{key} must be a string of at most {MAX_ID_LENGTH} characters")
+    return value
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+class TelemetryWriter:
+    """Buffers brushing status samples in memory and writes them in batches
+
+    /update-status only validates the samples, assigns each one to a
+    brushing session and appends it to the buffer, so it never waits on the
+    database. A background thread hands the buffer to the BrushingStore in a
+    single transaction every flush_interval_ms, or sooner once max_batch
+    samples are waiting.
+
+    Samples that carry a sessionId keep it. Otherwise a device's samples
+    belong to the same session until the brushing timer goes backwards (the
+    progress was reset) or no sample arrives for SESSION_GAP seconds.
+    Devices are told apart per user (or per client address when nobody is
+    signed in), so two users' devices with the same id never share a session.
+    Devices not heard from for SESSION_GAP seconds are forgotten.
+
+    If a batch cannot be written it is retried one sample at a time: samples
+    that fail because the database is unavailable go back in the buffer,
+    samples that fail for any other reason are dropped.
+    """
+
+    def __init__(self, store, flush_interval_ms=FLUSH_INTERVAL_MS, max_batch=MAX_BATCH_SIZE,
+                 session_gap=SESSION_GAP):
+        self.store = store
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.session_gap = session_gap
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._buffer = []
+        # (owner, device id) -> {'session_id', 'last_timestamp', 'total_seconds', 'seen'}, least recent first
+        self._sessions = OrderedDict()
+        self._running = True
+        self._accepted = 0
+        self._dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def add(self, samples, device_id=None, user_id=None, client=None):
+        """Queue status samples for the next batch
+
+        Returns the samples as stored, each with its device_id and session_id.
+        Raises ValueError if a sample is not a JSON object, in which case none
+        of the samples are queued.
+        """
+        # Validate the whole batch before any session changes
+        for sample in samples:
+            if not isinstance(sample, dict):
+                raise ValueError("Each sample must be a JSON object")
+        parsed = [self._parse(sample, device_id) for sample in samples]
+
+        owner = user_id or client
+        rows = []
+        with self._lock:
+            for sample_session, row in parsed:
+                device, timestamp, total_seconds = row[0], row[1], row[5]
+                session_id = sample_session or self._session_for((owner, device), timestamp, total_seconds)
+                rows.append((device, session_id, user_id) + row[1:])
+
+            self._buffer.extend(rows)
+            self._accepted += len(rows)
+            if len(self._buffer) > MAX_BUFFERED:
+                overflow = len(self._buffer) - MAX_BUFFERED
+                del self._buffer[:overflow]
+                self._dropped += overflow
+            if len(self._buffer) >= self.max_batch:
+                self._wakeup.notify()
+
+        return [{'device_id': row[0], 'session_id': row[1]} for row in rows]
+
+    def _parse(self, sample, device_id):
+        """Turn a sample into its sessionId and a row without the session and user"""
+        device_id = _check_id(sample, 'deviceId') or _check_id(sample, 'deviceIP') or device_id or 'unknown'
+        timestamp = _parse_timestamp(sample.get('timestamp')) or time.time()
+        total_seconds = _to_int(sample.get('totalSeconds'))
+
+        progress = sample.get('positionProgress')
+        if not isinstance(progress, list):
+            progress = []
+        progress = [_to_int(value) for value in progress[:len(POSITIONS)]]
+
+        return _check_id(sample, 'sessionId'), (
+            device_id,
+            timestamp,
+            bool(sample.get('brushingActive')),
+            bool(sample.get('brushingPaused')),
+            position_index(sample.get('currentPosition')),
+            total_seconds,
+            _to_int(sample.get('completedPositions')),
+            progress
+        )
+
+    def _session_for(self, key, timestamp, total_seconds):
+        now = time.time()
+        session = self._sessions.pop(key, None)
+        if (session is None
+                or total_seconds < session['total_seconds']
+                or timestamp - session['last_timestamp'] > self.session_gap):
+            session = {'session_id': uuid.uuid4().hex}
+        session['last_timestamp'] = timestamp
+        session['total_seconds'] = total_seconds
+        session['seen'] = now
+        self._sessions[key] = session
+
+        # Forget devices that went quiet, and the least recent beyond the limit
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest['seen'] >= now - self.session_gap and len(self._sessions) <= MAX_TRACKED_DEVICES:
+                break
+            self._sessions.popitem(last=False)
+        return session['session_id']
+
+    def stats(self):
+        """Counters for monitoring the ingestion path"""
+        with self._lock:
+            return {
+                'accepted': self._accepted,
+                'dropped': self._dropped,
+                'buffered': len(self._buffer),
+                'active_devices': len(self._sessions)
+            }
+
+    def flush(self):
+        """Write everything buffered so far in one transaction"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+
+        if not batch:
+            return 0
+
+        try:
+            self.store.append(batch)
+            return len(batch)
+        except Exception as e:
+            print(f"Error writing brushing samples: {e}")
+
+        # Write the samples one at a time, so one bad sample can't hold up the rest
+        written = 0
+        retry = []
+        bad = 0
+        for row in batch:
+            try:
+                self.store.append([row])
+                written += 1
+            except sqlite3.OperationalError:
+                retry.append(row)
+            except Exception as e:
+                print(f"Dropping a brushing sample that could not be written: {e}")
+                bad += 1
+
+        with self._lock:
+            self._dropped += bad
+            # Put what failed on a database error back in front of anything that arrived meanwhile
+            self._buffer[:0] = retry
+            if len(self._buffer) > MAX_BUFFERED:
+                overflow = len(self._buffer) - MAX_BUFFERED
+                del self._buffer[:overflow]
+                self._dropped += overflow
+        return written
+
+    def stop(self):
+        """Stop the background thread and write what is left"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._buffer) < self.max_batch:
+                    self._wakeup.wait(self.flush_interval)
+                running = self._running
+
+            if not running:
+                break
+
+            self.flush()